@@ -0,0 +1,291 @@
+import os
+import time
+from threading import Lock
+from app.sharding import HashRing
+
+# Seconds to collect bids before the best one so far wins; an auction with a
+# bid from every live node resolves sooner
+BID_TIMEOUT = float(os.getenv("BID_TIMEOUT", 0.5))
+# Seconds a node that won on a timed-out auction waits for better claims before running the job
+CLAIM_TIMEOUT = float(os.getenv("CLAIM_TIMEOUT", 0.2))
+# Seconds a resolved job is remembered, so it can be reclaimed if its winner dies
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", 300))
+# Most resolved (and finished, and published) jobs remembered at once; the oldest go first
+MAX_RESOLVED = int(os.getenv("MAX_RESOLVED", 10000))
+
+
+def best_bid(bids, live=None):
+    """
+    The winning (score, worker_id) among `bids`: lowest score, ties going to
+    the lowest worker_id, so every node picks the same winner from the same bids.
+
+    Args:
+        bids (dict): {worker_id: score}.
+        live (set): Only bids from these workers count, if given.
+    """
+    candidates = [(score, worker_id) for worker_id, score in bids.items() if live is None or worker_id in live]
+    return min(candidates) if candidates else None
+
+
+class AuctionBook:
+    """
+    Bids of the open auctions on one node, and the jobs they were resolved to.
+
+    An auction resolves as soon as every live worker has bid, or BID_TIMEOUT
+    after it opened with the bids that arrived by then, so a slow or dead
+    node delays a job by at most the timeout instead of stalling it forever.
+    Each node always holds its own bid, so the best live bidder always sees
+    itself winning and no job is left without a worker.
+
+    A node that sees itself winning claims the job (the caller publishes the
+    claim and feeds every claim it receives to `add_claim`), and the best
+    claim owns it. A winner that saw every live bid is the true best and runs
+    the job right away; one that won on a timeout, when a late bid may have
+    made another node win too, waits CLAIM_TIMEOUT for a better claim and
+    backs off if one arrives. Resolved jobs are kept until they are reported
+    done, so when a winner dies another live node takes over.
+
+    Once the winner is settled (its claim held) a resolved job keeps only its
+    winner and time: the payload, bids and claims are dropped, and a settled
+    job whose winner dies goes to the live node the job id hashes to, which
+    fetches the payload from the node that published the job (see `retain`).
+    """
+
+    def __init__(self, worker_id, bid_timeout=BID_TIMEOUT, retention=JOB_RETENTION, claim_timeout=CLAIM_TIMEOUT,
+                 max_resolved=MAX_RESOLVED):
+        self.worker_id = worker_id
+        self.bid_timeout = bid_timeout
+        self.claim_timeout = claim_timeout
+        self.retention = retention
+        self.max_resolved = max_resolved
+        self.lock = Lock()
+        self.open = {}      # {job_id: {"job", "opened", "bids": {worker_id: score}}}
+        # {job_id: {"resolved", "winner", "settled"}, plus "job", "bids" and "claims" until settled}
+        self.resolved = {}
+        self.claims = {}    # {job_id: (time seen, {worker_id: score})} claims seen before the job resolved here
+        self.claiming = {}  # {job_id: (deadline, latency)} jobs this node claimed and may still lose
+        self.finished = {}  # {job_id: time reported done}, so late bids don't reopen it
+        self.published = {}  # {job_id: (time, job)} jobs this node put up for auction, until done
+        self.fetching = {}  # {job_id: time} reclaimed jobs whose payload this node asked for
+        self.latency = {"auctions": 0, "sum": 0.0, "max": 0.0, "timeouts": 0, "reclaimed": 0, "contested": 0}
+
+    def add_bid(self, job_id, job, worker_id, score):
+        """
+        Records a bid, opening the auction on the first one seen.
+
+        Bids of other nodes carry no payload (`job` None); the job itself comes
+        with this node's own bid, whichever arrives first.
+        """
+        with self.lock:
+            if job_id in self.finished:
+                return
+            entry = self.resolved.get(job_id)
+            if entry is not None:
+                # Late bid: keep it as a fallback in case the winner dies
+                if not entry["settled"]:
+                    entry["bids"].setdefault(worker_id, score)
+                    if entry["job"] is None:
+                        entry["job"] = job
+                return
+            auction = self.open.setdefault(job_id, {"job": job, "opened": time.monotonic(), "bids": {}})
+            if auction["job"] is None:
+                auction["job"] = job
+            auction["bids"][worker_id] = score
+
+    def resolve(self, live, expected=1):
+        """
+        Resolves the auctions that are complete or past their deadline.
+
+        Args:
+            live (set): Worker ids currently alive.
+            expected (int): Bids needed, besides one from every live worker, to
+                resolve before the deadline (e.g. while heartbeats are still arriving).
+
+        Returns:
+            list: (job_id, score) of the auctions this node won; publish each as
+            a claim, then run the jobs `confirmed` returns.
+        """
+        won = []
+        now = time.monotonic()
+        with self.lock:
+            for job_id, auction in list(self.open.items()):
+                complete = live.issubset(auction["bids"]) and len(auction["bids"]) >= expected
+                timed_out = now - auction["opened"] >= self.bid_timeout
+                if not (complete or timed_out):
+                    continue
+                winner = best_bid(auction["bids"], live) or best_bid(auction["bids"])
+                del self.open[job_id]
+                claims = self.claims.pop(job_id, (now, {}))[1]
+                entry = self.resolved[job_id] = {"job": auction["job"], "resolved": now, "bids": auction["bids"],
+                                                 "winner": winner[1], "claims": claims, "settled": False}
+
+                latency = now - auction["opened"]
+                self.latency["auctions"] += 1
+                self.latency["sum"] += latency
+                self.latency["max"] = max(self.latency["max"], latency)
+                if not complete:
+                    self.latency["timeouts"] += 1
+                if winner[1] == self.worker_id:
+                    claims[self.worker_id] = winner[0]
+                    # Seeing every live bid makes this the best claim there can be
+                    self.claiming[job_id] = (now if complete else now + self.claim_timeout, latency)
+                    won.append((job_id, winner[0]))
+                if claims:
+                    entry["winner"] = best_bid(claims)[1]
+
+            for job_id, entry in list(self.resolved.items()):
+                if now - entry["resolved"] > self.retention:
+                    del self.resolved[job_id]
+                    self.claiming.pop(job_id, None)
+                elif (not entry["settled"] and job_id not in self.claiming and entry["winner"] in entry["claims"]
+                      and now - entry["resolved"] >= self.claim_timeout):
+                    # The winner claimed it and no better claim came in time
+                    self._settle(entry)
+            for book in (self.finished, self.fetching):
+                for job_id, seen in list(book.items()):
+                    if now - seen > self.retention:
+                        del book[job_id]
+            for book in (self.claims, self.published):
+                for job_id, (seen, _) in list(book.items()):
+                    if now - seen > self.retention:
+                        del book[job_id]
+            # Oldest first: the books are in insertion order
+            for book in (self.resolved, self.claims, self.finished, self.published, self.fetching):
+                while len(book) > self.max_resolved:
+                    job_id = next(iter(book))
+                    del book[job_id]
+                    self.claiming.pop(job_id, None)
+        return won
+
+    @staticmethod
+    def _settle(entry):
+        """Marks the winner of a resolved job final; returns the payload, which the entry no longer keeps."""
+        entry["settled"] = True
+        entry.pop("bids", None)
+        entry.pop("claims", None)
+        return entry.pop("job", None)
+
+    def add_claim(self, job_id, worker_id, score):
+        """Records another node's claim; the best claim becomes the job's winner."""
+        with self.lock:
+            if job_id in self.finished:
+                return
+            entry = self.resolved.get(job_id)
+            if entry is None:
+                self.claims.setdefault(job_id, (time.monotonic(), {}))[1][worker_id] = score
+                return
+            if not entry["settled"]:
+                entry["claims"][worker_id] = score
+                entry["winner"] = best_bid(entry["claims"])[1]
+
+    def confirmed(self):
+        """
+        Settles the claims of this node whose wait is over.
+
+        Returns:
+            list: (job_id, job, latency) of the jobs this node owns and should run.
+        """
+        run = []
+        now = time.monotonic()
+        with self.lock:
+            for job_id, (deadline, latency) in list(self.claiming.items()):
+                if now < deadline:
+                    continue
+                del self.claiming[job_id]
+                entry = self.resolved.get(job_id)
+                if entry is None:
+                    continue
+                job = self._settle(entry)
+                if entry["winner"] == self.worker_id:
+                    run.append((job_id, job, latency))
+                else:
+                    self.latency["contested"] += 1
+        return run
+
+    def reclaim(self, live):
+        """
+        Re-resolves jobs whose winner is no longer alive: among the remaining
+        bidders while the job is unsettled, else to the live node the job id
+        hashes to.
+
+        Returns:
+            list: (job_id, job) of the jobs this node takes over; job is None
+            when this node no longer has the payload and must fetch it (see
+            `fetched`).
+        """
+        taken = []
+        ring = None
+        now = time.monotonic()
+        with self.lock:
+            for job_id, entry in self.resolved.items():
+                if entry["winner"] in live:
+                    continue
+                if not entry["settled"]:
+                    winner = best_bid(entry["bids"], live)
+                    winner = winner[1] if winner else None
+                else:
+                    if ring is None:
+                        ring = HashRing(live)
+                    winner = ring.owner(job_id)
+                if winner is None:
+                    continue
+                entry["winner"] = winner
+                job = self._settle(entry)
+                self.claiming.pop(job_id, None)
+                self.latency["reclaimed"] += 1
+                if winner == self.worker_id:
+                    if job is None and job_id in self.published:
+                        job = self.published[job_id][1]
+                    if job is None:
+                        self.fetching[job_id] = now
+                    taken.append((job_id, job))
+        return taken
+
+    def retain(self, job_id, job):
+        """Keeps the payload of a job this node publishes until it is done, for nodes that reclaim it."""
+        with self.lock:
+            self.published[job_id] = (time.monotonic(), job)
+
+    def retained(self, job_id):
+        """The payload of a job this node published, or None."""
+        with self.lock:
+            published = self.published.get(job_id)
+            return published[1] if published else None
+
+    def fetched(self, job_id):
+        """True, once, when the payload of a job this node reclaimed without it arrives."""
+        with self.lock:
+            return self.fetching.pop(job_id, None) is not None
+
+    def reassign(self, job_id, worker_id):
+        """Records that a resolved job was handed to another worker (work stealing)."""
+        with self.lock:
+            if job_id in self.resolved:
+                self.resolved[job_id]["winner"] = worker_id
+                self._settle(self.resolved[job_id])
+                self.claiming.pop(job_id, None)
+
+    def done(self, job_id):
+        """Forgets a job once its winner reports it finished."""
+        with self.lock:
+            self.open.pop(job_id, None)
+            self.resolved.pop(job_id, None)
+            self.claims.pop(job_id, None)
+            self.claiming.pop(job_id, None)
+            self.published.pop(job_id, None)
+            self.fetching.pop(job_id, None)
+            self.finished[job_id] = time.monotonic()
+
+    def stats(self):
+        """Auction latency metrics: count, mean/max seconds, timeouts, lost claims, reclaims, open auctions."""
+        with self.lock:
+            auctions = self.latency["auctions"]
+            return {
+                "auctions": auctions,
+                "mean_latency": self.latency["sum"] / auctions if auctions else 0.0,
+                "max_latency": self.latency["max"],
+                "timeouts": self.latency["timeouts"],
+                "contested": self.latency["contested"],
+                "reclaimed": self.latency["reclaimed"],
+                "open": len(self.open),
+            }
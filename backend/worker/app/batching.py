@@ -0,0 +1,290 @@
+import heapq
+import itertools
+import time
+from collections import Counter, deque
+from threading import Condition, Lock
+
+# What put() does when a topic (or the scheduler as a whole) is at its bound
+DROP_OLDEST = "drop_oldest"  # shed the head of the topic's oldest open batch
+COALESCE = "coalesce"        # the new message replaces the ones queued for the same bovine
+BLOCK = "block"              # wait for room, shedding the new message after block_timeout;
+                             # only for producers that may stall (not an MQTT callback)
+
+
+class BatchScheduler:
+    """
+    Per-(topic, bovine_id) message batches, handed out as soon as they are due.
+
+    A batch is due when it holds `threshold(topic)` messages or when
+    `timeout(topic)` seconds have passed since its first message arrived.
+    Full batches go on a ready queue; open batches have their deadline on a
+    min-heap, so `put` is O(log n) and `next_batch` sleeps until the earliest
+    deadline or until a producer signals a full batch, instead of scanning
+    every queue on a timer.
+
+    Queued messages are bounded per topic (`max_queued`) and in total
+    (`max_total`); when a bound is hit the topic's overflow policy decides
+    what is shed, and `stats` reports the shed counts.
+
+    Due batches are handed out by topic priority, and only while the topic
+    has an in-flight slot: `max_in_flight` slots in all, of which
+    `reserved[topic]` can only be used by that topic, so e.g. a microphone
+    batch never waits behind a pool full of camera batches. The caller
+    reports each finished batch with `done`, which frees its slot and
+    records its latency against the topic's SLO.
+    """
+
+    def __init__(self, threshold, timeout, max_queued=None, max_total=None, policies=None, block_timeout=5.0,
+                 priorities=None, max_in_flight=None, reserved=None, slos=None, limits=None):
+        """
+        Args:
+            threshold (callable): topic -> number of messages that fills a batch.
+            timeout (callable): topic -> seconds a batch may wait for more messages.
+            max_queued (dict): {topic: max queued messages}; missing topics are unbounded.
+            max_total (int): Max queued messages over all topics, or None.
+            policies (dict): {topic: DROP_OLDEST | COALESCE | BLOCK}; DROP_OLDEST by default.
+            block_timeout (float): Seconds a BLOCK put waits for room.
+            priorities (dict): {topic: priority}; lower goes first, missing topics last.
+            max_in_flight (int): Batches dispatched and not yet done, or None for no limit.
+            reserved (dict): {topic: in-flight slots only that topic may use}.
+            slos (dict): {topic: latency target in seconds, first message to done}.
+            limits (dict): {topic: max in-flight batches of that topic}, e.g. its pool size.
+        """
+        self.threshold = threshold
+        self.timeout = timeout
+        self.max_queued = max_queued or {}
+        self.max_total = max_total
+        self.policies = policies or {}
+        self.block_timeout = block_timeout
+        self.priorities = priorities or {}
+        self.max_in_flight = max_in_flight
+        self.reserved = reserved or {}
+        self.slos = slos or {}
+        self.limits = limits or {}
+
+        lock = Lock()
+        self.condition = Condition(lock)  # signalled when a batch may be due
+        self.space = Condition(lock)      # signalled when queued messages are removed
+        self.batches = {}       # {(topic, bovine_id): [messages]}
+        self.deadlines = {}     # {(topic, bovine_id): deadline of the open batch}
+        self.opened = {}        # {(topic, bovine_id): time the open batch got its first message}
+        self.heap = []          # [(deadline, seq, key)], stale entries skipped on pop
+        self.ready = {}         # {topic: deque of due keys, in the order they became due}
+        self.ready_keys = set()
+        self.seq = itertools.count()
+        self.queued = Counter()  # {topic: queued messages}
+        self.total = 0
+        self.shed = Counter()    # {topic: messages shed}
+        self.in_flight = Counter()
+        self.latency = {}        # {topic: Counter of batches, wait/latency sums and maxima, SLO misses}
+        self.closed = False
+
+    def _full(self, topic):
+        limit = self.max_queued.get(topic)
+        return ((limit is not None and self.queued[topic] >= limit) or
+                (self.max_total is not None and self.total >= self.max_total))
+
+    def _discard(self, key, count):
+        """Removes the `count` oldest messages of a batch, closing it if it empties."""
+        batch = self.batches[key]
+        del batch[:count]
+        self.queued[key[0]] -= count
+        self.total -= count
+        self.shed[key[0]] += count
+        if not batch:
+            del self.batches[key]
+            self.deadlines.pop(key, None)
+            self.opened.pop(key, None)
+            self.ready_keys.discard(key)
+        self.space.notify_all()
+
+    def _make_room(self, key):
+        """
+        Applies the topic's overflow policy while the topic is full.
+
+        Returns:
+            bool: False if the new message has to be shed instead.
+        """
+        topic = key[0]
+        policy = self.policies.get(topic, DROP_OLDEST)
+        if policy == BLOCK:
+            deadline = time.monotonic() + self.block_timeout
+            while self._full(topic) and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.space.wait(remaining)
+            return True
+        if policy == COALESCE:
+            if key not in self.batches:
+                return False
+            self._discard(key, len(self.batches[key]))
+
+        # DROP_OLDEST, and COALESCE while a bound still does not hold: shed from
+        # the head of the topic's oldest open batch (earliest deadline)
+        while self._full(topic):
+            keys = [k for k in self.batches if k[0] == topic]
+            if not keys:
+                return False
+            self._discard(min(keys, key=lambda k: self.deadlines[k]), 1)
+        return True
+
+    def put(self, topic, bovine_id, message):
+        """
+        Adds a message to its batch and wakes the dispatcher if the batch is now due.
+
+        Returns:
+            bool: False if the message was shed by the overflow policy.
+        """
+        key = (topic, bovine_id)
+        with self.condition:
+            if self._full(topic) and not self._make_room(key):
+                self.shed[topic] += 1
+                return False
+
+            batch = self.batches.setdefault(key, [])
+            batch.append(message)
+            self.queued[topic] += 1
+            self.total += 1
+            notify = False
+            if len(batch) == 1:
+                now = time.monotonic()
+                deadline = now + self.timeout(topic)
+                self.opened[key] = now
+                self.deadlines[key] = deadline
+                heapq.heappush(self.heap, (deadline, next(self.seq), key))
+                # Only a new earliest deadline changes how long the dispatcher sleeps
+                notify = self.heap[0][2] == key
+            if len(batch) >= self.threshold(topic) and key not in self.ready_keys:
+                self._mark_ready(key)
+                notify = True
+            if notify:
+                self.condition.notify()
+            return True
+
+    def _mark_ready(self, key):
+        self.ready.setdefault(key[0], deque()).append(key)
+        self.ready_keys.add(key)
+
+    def _has_slot(self, topic):
+        if topic in self.limits and self.in_flight[topic] >= self.limits[topic]:
+            return False
+        if self.max_in_flight is None:
+            return True
+        if self.in_flight[topic] < self.reserved.get(topic, 0):
+            return True
+        # Slots beyond a topic's reservation come from the shared ones
+        shared_used = sum(max(0, count - self.reserved.get(t, 0)) for t, count in self.in_flight.items())
+        return shared_used < self.max_in_flight - sum(self.reserved.values())
+
+    def _next_ready(self):
+        """The first due key of the highest-priority topic that has a free slot."""
+        for topic in sorted(self.ready, key=lambda t: self.priorities.get(t, float("inf"))):
+            keys = self.ready[topic]
+            if not keys or not self._has_slot(topic):
+                continue
+            while keys:
+                key = keys.popleft()
+                if key in self.ready_keys:
+                    return key
+        return None
+
+    def _take(self, key, now):
+        self.ready_keys.discard(key)
+        self.deadlines.pop(key, None)
+        opened = self.opened.pop(key)
+        messages = self.batches.pop(key)
+        self.queued[key[0]] -= len(messages)
+        self.total -= len(messages)
+        self.in_flight[key[0]] += 1
+
+        stats = self.latency.setdefault(key[0], Counter())
+        wait = now - opened
+        stats["batches"] += 1
+        stats["wait_sum"] += wait
+        stats["wait_max"] = max(stats["wait_max"], wait)
+        self.space.notify_all()
+        return key[0], key[1], messages, opened
+
+    def next_batch(self):
+        """
+        Blocks until a batch is due and its topic has a free slot, and removes it.
+
+        Returns:
+            tuple: (topic, bovine_id, messages, opened), `opened` being the
+            time.monotonic() of the batch's first message (pass it to `done`),
+            or None once the scheduler is closed.
+        """
+        with self.condition:
+            while not self.closed:
+                now = time.monotonic()
+                while self.heap:
+                    deadline, _, key = self.heap[0]
+                    if self.deadlines.get(key) != deadline:
+                        heapq.heappop(self.heap)  # batch already dispatched or shed
+                    elif deadline <= now:
+                        heapq.heappop(self.heap)
+                        if key not in self.ready_keys:
+                            self._mark_ready(key)
+                    else:
+                        break
+
+                key = self._next_ready()
+                if key is not None:
+                    return self._take(key, now)
+                self.condition.wait(self.heap[0][0] - now if self.heap else None)
+            return None
+
+    def done(self, topic, opened):
+        """
+        Frees the slot of a finished batch and records its latency.
+
+        Returns:
+            float: Seconds from the batch's first message until now.
+        """
+        with self.condition:
+            self.in_flight[topic] -= 1
+            latency = time.monotonic() - opened
+            stats = self.latency.setdefault(topic, Counter())
+            stats["done"] += 1
+            stats["latency_sum"] += latency
+            stats["latency_max"] = max(stats["latency_max"], latency)
+            if topic in self.slos and latency > self.slos[topic]:
+                stats["slo_misses"] += 1
+            self.condition.notify()
+            return latency
+
+    def pending(self):
+        """Number of messages waiting in open batches."""
+        with self.condition:
+            return self.total
+
+    def stats(self):
+        """Queued, shed and in-flight counts and queue-wait/latency figures per topic."""
+        with self.condition:
+            return {
+                "queued": {topic: count for topic, count in self.queued.items() if count},
+                "queued_total": self.total,
+                "shed": dict(self.shed),
+                "shed_total": sum(self.shed.values()),
+                "in_flight": {topic: count for topic, count in self.in_flight.items() if count},
+                "latency": {
+                    topic: {
+                        "batches": stats["batches"],
+                        "mean_wait": stats["wait_sum"] / stats["batches"] if stats["batches"] else 0.0,
+                        "max_wait": stats["wait_max"],
+                        "mean_latency": stats["latency_sum"] / stats["done"] if stats["done"] else 0.0,
+                        "max_latency": stats["latency_max"],
+                        "slo": self.slos.get(topic),
+                        "slo_misses": stats["slo_misses"],
+                    }
+                    for topic, stats in self.latency.items()
+                },
+            }
+
+    def close(self):
+        """Wakes the dispatcher and blocked producers; next_batch returns None."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+            self.space.notify_all()
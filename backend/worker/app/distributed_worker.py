@@ -3,6 +3,8 @@ import json
 import time
 import uuid
 import random
+import base64
+import numpy as np
 import paho.mqtt.client as mqtt
 from app.mapping import microphone_pipeline,accelerometer_pipeline,camera_pipeline
 topic_to_pipeline = {
@@ -11,17 +13,142 @@ topic_to_pipeline = {
     "inference/camera": camera_pipeline,
 }
 import threading
-import psutil
 from concurrent.futures import ProcessPoolExecutor
 from threading import Lock
-from queue import Queue
-from collections import defaultdict
+from collections import defaultdict, deque
+from app.model_registry import ModelRegistry, preloaded_topics
+from app.sharding import ShardMembership
+from app.auction import AuctionBook, BID_TIMEOUT, JOB_RETENTION
+from app.load_score import LoadScorer
+from app.ingest import INGEST_TOPICS, create_scheduler, SensorIngest
 
 MQTT_BROKER = os.getenv("MQTT_BROKER", "mosquitto")
 MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))
 MQTT_TOPIC_IN = os.getenv("MQTT_TOPIC_IN", "inference/topic")
 MQTT_TOPIC_BIDS = "auction/bids"
+# Winners report finished jobs here so the other nodes stop tracking them
+MQTT_TOPIC_DONE = os.getenv("MQTT_TOPIC_DONE", "auction/done")
+MQTT_TOPIC_METRICS = os.getenv("MQTT_TOPIC_METRICS", "workers/metrics")
+# Bids that resolve an auction before BID_TIMEOUT (with one from every live node)
 NUM_NODES = int(os.getenv("NUM_NODES", 2))
+DISTRIBUTED_POOL_SIZE = int(os.getenv("DISTRIBUTED_POOL_SIZE", 4))
+
+# How jobs are assigned to workers:
+#   auction - every worker bids on every job, the best score wins
+#   hash    - consistent hash of bovine_id over the live workers; each worker
+#             keeps the jobs of its own shard, no per-job messages
+#   shared  - MQTT shared subscription, the broker hands each job to one worker
+ASSIGNMENT_MODE = os.getenv("ASSIGNMENT_MODE", "auction")
+MQTT_TOPIC_MEMBERS = os.getenv("MQTT_TOPIC_MEMBERS", "workers/members")
+SHARE_GROUP = os.getenv("SHARE_GROUP", "inference-workers")
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", 2))
+# A worker missing heartbeats this long is dropped from the ring
+MEMBER_TIMEOUT = float(os.getenv("MEMBER_TIMEOUT", HEARTBEAT_INTERVAL * 3))
+# Seconds a starting worker listens to the others' heartbeats before it joins:
+# until then its ring holds only itself, so it would claim every shard
+JOIN_DELAY = float(os.getenv("JOIN_DELAY", HEARTBEAT_INTERVAL * 1.5))
+
+# Work stealing: idle nodes advertise free pool slots on MQTT_TOPIC_STEAL and
+# busy nodes hand them jobs that have not started yet
+WORK_STEALING = os.getenv("WORK_STEALING", "true").lower() == "true"
+MQTT_TOPIC_STEAL = os.getenv("MQTT_TOPIC_STEAL", "workers/steal")
+# Seconds between idle adverts while a node has free slots and nothing queued
+STEAL_INTERVAL = float(os.getenv("STEAL_INTERVAL", 0.5))
+# Seconds a handoff may go unacknowledged before the sender asks for the jobs back
+HANDOFF_ACK_TIMEOUT = float(os.getenv("HANDOFF_ACK_TIMEOUT", 5))
+
+# Sensor ingest: every worker subscribes to the sensor topics, reassembles and
+# batches the bovines of its own shard like the local worker does, and assigns
+# whole batches (auctioned, hashed or shared) instead of single messages
+DISTRIBUTED_INGEST = os.getenv("DISTRIBUTED_INGEST", "true").lower() == "true"
+
+
+def job_topic(job):
+    """The topic of a job (one message or a batch of them)."""
+    message = job[0] if isinstance(job, list) and job else job
+    return message.get("topic") if isinstance(message, dict) else None
+
+
+def encode_job(value):
+    """
+    Makes a batch JSON-safe for MQTT: bytes (audio clips, camera frames) become
+    base64 and NumPy arrays (accelerometer windows) base64 plus dtype and shape.
+    """
+    if isinstance(value, dict):
+        return {key: encode_job(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [encode_job(item) for item in value]
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"__bytes__": base64.b64encode(value).decode()}
+    if isinstance(value, np.ndarray):
+        return {"__ndarray__": base64.b64encode(np.ascontiguousarray(value)).decode(),
+                "dtype": value.dtype.str, "shape": list(value.shape)}
+    return value
+
+
+def decode_job(value):
+    """Reverses encode_job."""
+    if isinstance(value, dict):
+        if "__bytes__" in value:
+            return base64.b64decode(value["__bytes__"])
+        if "__ndarray__" in value:
+            return np.frombuffer(base64.b64decode(value["__ndarray__"]),
+                                 dtype=value["dtype"]).reshape(value["shape"])
+        return {key: decode_job(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_job(item) for item in value]
+    return value
+
+
+def run_inference_and_publish(worker_id, messages):
+    """
+    Runs in a separate process from ProcessPoolExecutor.
+
+    Args:
+        worker_id: Id of the node that submitted the job, for logging.
+        messages: List of messages to process in batch
+
+    Returns:
+        tuple: (pipeline result, seconds the pipeline took)
+    """
+    start = time.time()
+    try:
+        if not isinstance(messages, list):
+            messages = [messages]  # Handle single message case for backward compatibility
+        messages = decode_job(messages)
+            
+        if not messages:
+            return None, time.time() - start
+            
+        # All messages in a batch should have the same topic
+        topic = messages[0]["topic"]
+        bovine_id = messages[0]["bovine_id"]
+        
+        # Create batch message
+        batch_message = {
+            "topic": topic,
+            "bovine_id": bovine_id,
+            "batch_size": len(messages),
+            "timestamp": time.time(),
+            "data": messages
+        }
+        
+        # Get and run appropriate pipeline
+        pipeline = topic_to_pipeline.get(topic)
+        if pipeline:
+            result = pipeline(batch_message)
+            print(f"[{worker_id}] Successfully processed batch of {len(messages)} messages for bovine {bovine_id}")
+            return result, time.time() - start
+            
+    except Exception as e:
+        print(f"[{worker_id}] Error in inference: {str(e)}")
+    return None, time.time() - start
+
+
+def job_bovine_id(job):
+    """The bovine a job (one message or a batch of them) belongs to."""
+    message = job[0] if isinstance(job, list) and job else job
+    return message.get("bovine_id") if isinstance(message, dict) else None
 
 class DistributedWorker:
     def __init__(self):
@@ -30,60 +157,190 @@ class DistributedWorker:
         Creates thread-safe data structures for cross-thread communication.
         """
         self.worker_id = str(uuid.uuid4())
-        self.bids_lock = Lock()
-        self.bids = {}
         self.client = None
         self.executor = None
-        self.job_queue = Queue()  # Thread-safe queue for jobs
+        # Jobs not submitted yet; only these can be handed to other nodes
+        self.backlog = deque()  # [(job_id, job)]
+        self.backlog_lock = Lock()
+        self.handoffs = {}  # {job_id: [thief_id, job, handoff_id, time sent or revoked, acked]} until reported done
+        self.stolen = {}    # {job_id: sender} jobs received by handoff, until reported done
+        self.revoked = {}   # {handoff_id: time} handoffs given back, so late copies of them are ignored
+        self.last_idle_advert = 0.0
+        # Set once this worker has heard the members and announced itself (see heartbeat)
+        self.joined = threading.Event()
+        self.membership = ShardMembership(self.worker_id, MEMBER_TIMEOUT)
+        self.auctions = AuctionBook(self.worker_id)
+        # The pool preloads every model (init_worker with env_vars=None)
+        self.scorer = LoadScorer(DISTRIBUTED_POOL_SIZE, preloaded_topics(None))
+        # No in-flight limits: batches leave as soon as they are due, the pool limits are the assignment's job
+        self.scheduler = create_scheduler()
+        self.ingest = SensorIngest(self.scheduler, self.worker_id, accept=self.membership.owns)
         
-    def get_score(self):
+    def get_score(self, topic=None):
         """
         Runs in the MQTT client thread.
-        Thread-safe as it only reads system metrics.
+        Estimated seconds for this node to finish a job of `topic` (see LoadScorer).
         """
         # Lower is better
-        cpu = psutil.cpu_percent()
-        mem = psutil.virtual_memory().percent
-        return cpu + mem
+        return self.scorer.score(topic)
+
+    def queue_job(self, job_id, job):
+        with self.backlog_lock:
+            self.scorer.job_queued()
+            self.backlog.append((job_id, job))
+
+    def submit_jobs(self):
+        """Submits queued jobs while the pool has free processes; the rest stay stealable."""
+        while self.scorer.free_slots() > 0:
+            with self.backlog_lock:
+                if not self.backlog:
+                    return
+                job_id, job = self.backlog.popleft()
+                self.scorer.job_started()
+            future = self.executor.submit(run_inference_and_publish, self.worker_id, job)
+            future.add_done_callback(lambda f, job_id=job_id, topic=job_topic(job): self.job_done(job_id, topic, f))
 
-    def run_inference_and_publish(self, messages):
+    def advertise_idle(self):
+        """Tells the other nodes how many jobs this node can start right away."""
+        now = time.monotonic()
+        if not self.joined.is_set() or now - self.last_idle_advert < STEAL_INTERVAL:
+            return
+        slots = self.scorer.free_slots()
+        with self.backlog_lock:
+            if self.backlog:
+                return
+        if slots > 0:
+            self.last_idle_advert = now
+            self.client.publish(MQTT_TOPIC_STEAL, json.dumps({"type": "idle", "worker_id": self.worker_id, "slots": slots}))
+
+    def publish_steal(self, message):
+        self.client.publish(MQTT_TOPIC_STEAL, json.dumps(message), qos=1)
+
+    def on_steal_message(self, message):
         """
-        Runs in a separate process from ProcessPoolExecutor.
-        Each invocation creates a new process.
-        
-        Args:
-            messages: List of messages to process in batch
+        Runs in the MQTT client thread.
+
+        idle:    a node has free slots; hand it up to that many queued jobs. The jobs
+                 leave the backlog before they are sent, so they can only run there.
+                 Jobs this node got by handoff are not passed on.
+        handoff: jobs changed owner; every node updates the auction winner, the
+                 receiving node queues the ones it has not seen yet and acknowledges.
+        ack:     the receiver has the jobs; the sender keeps them until they are done,
+                 to take them back if the receiver dies.
+        revoke:  the sender got no ack in time; the receiver gives back the jobs it has
+                 not started (revoked) and acknowledges the rest.
+        revoked: the jobs are back with the sender; every node updates the auction winner.
+        done:    the receiver finished the jobs; the sender forgets them.
         """
+        kind = message["type"]
+        if kind == "idle" and message["worker_id"] != self.worker_id:
+            # Makes sure the receiver is a member, so it expires (and its unacknowledged jobs come back) if it dies
+            self.membership.heartbeat(message["worker_id"])
+            with self.backlog_lock:
+                # Newest first: the jobs that would wait longest here
+                jobs = [(job_id, job) for job_id, job in reversed(self.backlog)
+                        if job_id not in self.stolen][:message["slots"]]
+                if not jobs:
+                    return
+                handed = {job_id for job_id, _ in jobs}
+                self.backlog = deque(entry for entry in self.backlog if entry[0] not in handed)
+                self.scorer.job_handed_off(len(jobs))
+                handoff_id = str(uuid.uuid4())
+                now = time.monotonic()
+                for job_id, job in jobs:
+                    self.handoffs[job_id] = [message["worker_id"], job, handoff_id, now, False]
+                    self.auctions.reassign(job_id, message["worker_id"])
+            print(f"[{self.worker_id}] Handing {len(jobs)} queued jobs to idle worker {message['worker_id']}")
+            self.publish_steal({"type": "handoff", "handoff_id": handoff_id, "from": self.worker_id,
+                                "to": message["worker_id"], "jobs": jobs})
+
+        elif kind == "handoff":
+            for job_id, _ in message["jobs"]:
+                self.auctions.reassign(job_id, message["to"])
+            if message["to"] == self.worker_id:
+                with self.backlog_lock:
+                    if message["handoff_id"] in self.revoked:
+                        return
+                    # A redelivered handoff is acknowledged again but queued once
+                    jobs = [(job_id, job) for job_id, job in message["jobs"] if job_id not in self.stolen]
+                    for job_id, _ in jobs:
+                        self.stolen[job_id] = message["from"]
+                for job_id, job in jobs:
+                    self.queue_job(job_id, job)
+                print(f"[{self.worker_id}] Took {len(jobs)} jobs from worker {message['from']}")
+                self.publish_steal({"type": "ack", "from": message["from"], "to": self.worker_id,
+                                    "job_ids": [job_id for job_id, _ in message["jobs"]]})
+
+        elif kind == "ack" and message["from"] == self.worker_id:
+            with self.backlog_lock:
+                for job_id in message["job_ids"]:
+                    if job_id in self.handoffs:
+                        self.handoffs[job_id][4] = True
+
+        elif kind == "revoke" and message["to"] == self.worker_id:
+            with self.backlog_lock:
+                revoked = set(message["job_ids"]) - set(self.stolen)
+                queued = [job_id for job_id, _ in self.backlog if job_id in message["job_ids"]]
+                revoked.update(queued)
+                self.backlog = deque(entry for entry in self.backlog if entry[0] not in revoked)
+                self.scorer.job_handed_off(len(queued))
+                self.revoked[message["handoff_id"]] = time.monotonic()
+                for job_id in revoked:
+                    self.stolen.pop(job_id, None)
+                started = [job_id for job_id in message["job_ids"] if job_id not in revoked]
+            if revoked:
+                self.publish_steal({"type": "revoked", "handoff_id": message["handoff_id"], "from": message["from"],
+                                    "to": self.worker_id, "job_ids": sorted(revoked)})
+            if started:
+                self.publish_steal({"type": "ack", "from": message["from"], "to": self.worker_id, "job_ids": started})
+
+        elif kind == "revoked":
+            for job_id in message["job_ids"]:
+                self.auctions.reassign(job_id, message["from"])
+            if message["from"] == self.worker_id:
+                with self.backlog_lock:
+                    jobs = [(job_id, self.handoffs.pop(job_id)[1]) for job_id in message["job_ids"]
+                            if job_id in self.handoffs and self.handoffs[job_id][2] == message["handoff_id"]]
+                for job_id, job in jobs:
+                    print(f"[{self.worker_id}] Took back job {job_id}, its handoff was never acknowledged")
+                    self.queue_job(job_id, job)
+
+        elif kind == "done" and message["from"] == self.worker_id:
+            with self.backlog_lock:
+                for job_id in message["job_ids"]:
+                    self.handoffs.pop(job_id, None)
+
+    def check_handoffs(self):
+        """Asks for the jobs of handoffs that went unacknowledged for HANDOFF_ACK_TIMEOUT back."""
+        now = time.monotonic()
+        overdue = defaultdict(list)
+        with self.backlog_lock:
+            for job_id, handoff in self.handoffs.items():
+                if not handoff[4] and now - handoff[3] > HANDOFF_ACK_TIMEOUT:
+                    handoff[3] = now
+                    overdue[handoff[0], handoff[2]].append(job_id)
+            for handoff_id, revoked in list(self.revoked.items()):
+                if now - revoked > JOB_RETENTION:
+                    del self.revoked[handoff_id]
+        for (thief, handoff_id), job_ids in overdue.items():
+            print(f"[{self.worker_id}] No ack from worker {thief} for {len(job_ids)} jobs, asking for them back")
+            self.publish_steal({"type": "revoke", "handoff_id": handoff_id, "from": self.worker_id,
+                                "to": thief, "job_ids": job_ids})
+
+    def job_done(self, job_id, topic, future):
+        """Runs when a submitted job finishes: records its service time and reports it."""
         try:
-            if not isinstance(messages, list):
-                messages = [messages]  # Handle single message case for backward compatibility
-                
-            if not messages:
-                return None
-                
-            # All messages in a batch should have the same topic
-            topic = messages[0]["topic"]
-            bovine_id = messages[0]["bovine_id"]
-            
-            # Create batch message
-            batch_message = {
-                "topic": topic,
-                "bovine_id": bovine_id,
-                "batch_size": len(messages),
-                "timestamp": time.time(),
-                "data": messages
-            }
-            
-            # Get and run appropriate pipeline
-            pipeline = topic_to_pipeline.get(topic)
-            if pipeline:
-                result = pipeline(batch_message)
-                print(f"[{self.worker_id}] Successfully processed batch of {len(messages)} messages for bovine {bovine_id}")
-                return result
-                
+            _, service_time = future.result()
         except Exception as e:
-            print(f"[{self.worker_id}] Error in inference: {str(e)}")
-        return None
+            print(f"[{self.worker_id}] Job {job_id} failed: {str(e)}")
+            service_time = None
+        self.scorer.job_finished(topic, service_time)
+        if ASSIGNMENT_MODE == "auction":
+            self.client.publish(MQTT_TOPIC_DONE, json.dumps({"job_id": job_id, "worker_id": self.worker_id}))
+        with self.backlog_lock:
+            sender = self.stolen.pop(job_id, None)
+        if sender is not None:
+            self.publish_steal({"type": "done", "from": sender, "to": self.worker_id, "job_ids": [job_id]})
 
     def on_message(self, client, userdata, msg):
         """
@@ -91,72 +348,209 @@ class DistributedWorker:
         Uses thread-safe data structures for cross-thread communication.
         """
         try:
-            if msg.topic == MQTT_TOPIC_IN:
-                print(f"[{self.worker_id}] Received job: {msg.payload.decode()}")
+            if msg.topic in INGEST_TOPICS:
+                # Before joining this worker would take every bovine for its own
+                if self.joined.is_set():
+                    self.ingest.handle(msg)
+
+            elif msg.topic == MQTT_TOPIC_IN and ASSIGNMENT_MODE != "auction":
                 message = json.loads(msg.payload.decode())
-                score = self.get_score()
+                job = message["job"]
+                # Hash mode: every worker sees the job, only the shard owner keeps it
+                if ASSIGNMENT_MODE == "hash" and not self.membership.owns(job_bovine_id(job)):
+                    return
+                print(f"[{self.worker_id}] Assigned job {message.get('job_id')} for bovine {job_bovine_id(job)}")
+                self.queue_job(message.get("job_id"), job)
+
+            elif msg.topic == MQTT_TOPIC_MEMBERS:
+                member = json.loads(msg.payload.decode())
+                if member.get("status") == "offline":
+                    if self.membership.leave(member["worker_id"]):
+                        print(f"[{self.worker_id}] Worker {member['worker_id']} left, shards rebalanced: {self.membership.members()}")
+                        self.reclaim_jobs()
+                elif self.membership.heartbeat(member["worker_id"]):
+                    print(f"[{self.worker_id}] Worker {member['worker_id']} joined, shards rebalanced: {self.membership.members()}")
+
+            elif msg.topic == MQTT_TOPIC_IN:
+                if not self.joined.is_set():
+                    return  # a bid would make the others count this worker in before it is ready
+                message = json.loads(msg.payload.decode())
+                if "to" in message:
+                    # The payload of a reclaimed job, re-sent by its publisher to the node that asked
+                    if message["to"] == self.worker_id and self.auctions.fetched(message["job_id"]):
+                        print(f"[{self.worker_id}] Fetched reclaimed job {message['job_id']}")
+                        self.queue_job(message["job_id"], message["job"])
+                    return
+                print(f"[{self.worker_id}] Received job {message['job_id']} on topic {job_topic(message['job'])}")
+                score = self.get_score(job_topic(message["job"]))
+                # Our own bid counts even if the broker is slow to echo it back
+                self.auctions.add_bid(message["job_id"], message["job"], self.worker_id, score)
                 bid_payload = json.dumps({
                     "worker_id": self.worker_id,
                     "score": score,
                     "job_id": message["job_id"],
-                    "job": message["job"],
                 })
                 client.publish(MQTT_TOPIC_BIDS, bid_payload)
 
             elif msg.topic == MQTT_TOPIC_BIDS:
                 bid = json.loads(msg.payload.decode())
-                job = bid["job"]
-                score = bid["score"]
-                worker_id = bid["worker_id"]
-                
-                # Thread-safe bid management
-                with self.bids_lock:
-                    if job not in self.bids:
-                        self.bids[job] = []
-                    self.bids[job].append((score, worker_id))
-                    
+                # A bidding node is alive, even before its first heartbeat
+                self.membership.heartbeat(bid["worker_id"])
+                if bid.get("type") == "claim":
+                    # Another node saw itself winning; the best claim runs the job
+                    self.auctions.add_claim(bid["job_id"], bid["worker_id"], bid["score"])
+                elif bid.get("type") == "fetch":
+                    # A node reclaimed a settled job, whose payload only its publisher still has
+                    job = self.auctions.retained(bid["job_id"])
+                    if job is not None:
+                        self.client.publish(MQTT_TOPIC_IN, json.dumps({"job_id": bid["job_id"], "job": job,
+                                                                       "to": bid["worker_id"]}), qos=1)
+                else:
+                    # Every bidder got the job on MQTT_TOPIC_IN; the bid only carries the score
+                    self.auctions.add_bid(bid["job_id"], None, bid["worker_id"], bid["score"])
+
+            elif msg.topic == MQTT_TOPIC_DONE:
+                self.auctions.done(json.loads(msg.payload.decode())["job_id"])
+
+            elif msg.topic == MQTT_TOPIC_STEAL:
+                self.on_steal_message(json.loads(msg.payload.decode()))
+
         except Exception as e:
             print(f"[{self.worker_id}] Error in message handler: {str(e)}")
 
+    def batch_dispatcher(self):
+        """
+        Runs in a dedicated thread created by start().
+        Takes the due batches of this node's shard off the scheduler: hash mode
+        queues them here (this node owns their bovines), auction and shared mode
+        publish them as one job each.
+        """
+        while True:
+            batch = self.scheduler.next_batch()
+            if batch is None:
+                return
+            topic, bovine_id, messages, opened = batch
+            try:
+                job_id = str(uuid.uuid4())
+                job = encode_job(messages)
+                print(f"[{self.worker_id}] Dispatching batch {job_id} of {len(messages)} messages "
+                      f"for bovine {bovine_id} on topic {topic}")
+                if ASSIGNMENT_MODE == "hash":
+                    self.queue_job(job_id, job)
+                else:
+                    if ASSIGNMENT_MODE == "auction":
+                        self.auctions.retain(job_id, job)
+                    self.client.publish(MQTT_TOPIC_IN, json.dumps({"job_id": job_id, "job": job}), qos=1)
+            except Exception as e:
+                print(f"[{self.worker_id}] Error dispatching batch: {str(e)}")
+            finally:
+                self.scheduler.done(topic, opened)
+
     def bid_watcher(self):
         """
         Runs in a dedicated thread created by start().
-        Uses thread-safe operations to manage bids and job queue.
+        Resolves auctions as they complete or time out, claims the ones this
+        node won and submits the jobs whose claim held, plus the jobs queued
+        directly in hash and shared mode, as pool processes free up.
         """
         while True:
-            jobs_to_process = []
-            
-            # Thread-safe bid processing
-            with self.bids_lock:
-                for job, bid_list in list(self.bids.items()):
-                    if len(bid_list) >= NUM_NODES:
-                        # Find the best bid (lowest score)
-                        best_score, best_worker = min(bid_list)
-                        if best_worker == self.worker_id:
-                            jobs_to_process.append(job)
-                        del self.bids[job]
-            
-            # Queue jobs for processing
-            for job in jobs_to_process:
-                print(f"[{self.worker_id}] Won bid for job: {job}")
-                self.job_queue.put(job)
-            
+            if ASSIGNMENT_MODE == "auction":
+                for job_id, score in self.auctions.resolve(set(self.membership.members()), NUM_NODES):
+                    self.client.publish(MQTT_TOPIC_BIDS, json.dumps({
+                        "type": "claim", "worker_id": self.worker_id, "job_id": job_id, "score": score}))
+                for job_id, job, latency in self.auctions.confirmed():
+                    print(f"[{self.worker_id}] Won bid for job {job_id} (auction took {latency * 1000:.1f} ms)")
+                    self.queue_job(job_id, job)
+
             # Process queued jobs
-            while not self.job_queue.empty():
-                job = self.job_queue.get()
-                future = self.executor.submit(self.run_inference_and_publish, job)
-                self.job_queue.task_done()
-            
-            time.sleep(0.1)
+            self.submit_jobs()
+            if WORK_STEALING:
+                self.advertise_idle()
+                self.check_handoffs()
+
+            time.sleep(min(0.1, BID_TIMEOUT / 5))
+
+    def reclaim_jobs(self):
+        """
+        Takes over the jobs this node is next in line for after their winner
+        died, and the handed-off jobs whose receiver died before finishing them.
+
+        In auction mode a handoff made the receiver the auction winner on every
+        node, so the auction book alone picks who takes its jobs over; taking
+        them back here as well could run them twice.
+        """
+        live = set(self.membership.members())
+        for job_id, job in self.auctions.reclaim(live):
+            if job is None:
+                print(f"[{self.worker_id}] Reclaimed job {job_id} from a dead worker, fetching it from its publisher")
+                self.client.publish(MQTT_TOPIC_BIDS, json.dumps({"type": "fetch", "worker_id": self.worker_id,
+                                                                 "job_id": job_id}))
+                continue
+            print(f"[{self.worker_id}] Reclaimed job {job_id} from a dead worker")
+            self.queue_job(job_id, job)
+
+        with self.backlog_lock:
+            lost = [(job_id, handoff[1]) for job_id, handoff in self.handoffs.items() if handoff[0] not in live]
+            for job_id, _ in lost:
+                del self.handoffs[job_id]
+        if ASSIGNMENT_MODE == "auction":
+            return
+        for job_id, job in lost:
+            print(f"[{self.worker_id}] Took back job {job_id}, its receiver died before finishing it")
+            self.queue_job(job_id, job)
+
+    def heartbeat(self):
+        """
+        Runs in a dedicated thread created by start().
+        Listens for JOIN_DELAY, so the ring holds the running workers, then
+        announces this worker, drops workers whose heartbeats stopped,
+        samples the load for bidding and publishes the auction metrics.
+
+        Joining and starting to ingest happen together: the others hand this
+        worker its shards when its first heartbeat arrives.
+        """
+        time.sleep(JOIN_DELAY)
+        self.joined.set()
+        print(f"[{self.worker_id}] Joining workers {self.membership.members()}")
+        while True:
+            self.scorer.sample()
+            self.client.publish(MQTT_TOPIC_MEMBERS, json.dumps({"worker_id": self.worker_id, "status": "online"}))
+            expired = self.membership.expire()
+            if expired:
+                print(f"[{self.worker_id}] Workers {expired} timed out, shards rebalanced: {self.membership.members()}")
+                self.reclaim_jobs()
+            if ASSIGNMENT_MODE == "auction":
+                self.client.publish(MQTT_TOPIC_METRICS, json.dumps({"worker_id": self.worker_id,
+                                                                    "auction": self.auctions.stats(),
+                                                                    "load": self.scorer.stats(),
+                                                                    "ingest": self.scheduler.stats()}))
+            time.sleep(HEARTBEAT_INTERVAL)
 
     def mqtt_subscribe(self):
         """
         Runs in the main thread but creates a background thread for MQTT operations.
         """
-        client = mqtt.Client()
+        # MQTT v5, so camera frames can carry their metadata as user properties
+        client = mqtt.Client(protocol=mqtt.MQTTv5)
         client.on_message = self.on_message
+        # The broker announces our departure if we die without disconnecting
+        client.will_set(MQTT_TOPIC_MEMBERS, json.dumps({"worker_id": self.worker_id, "status": "offline"}))
         client.connect(MQTT_BROKER, MQTT_PORT)
-        client.subscribe([(MQTT_TOPIC_IN, 0), (MQTT_TOPIC_BIDS, 0)])
+        # Every mode tracks the members: hash mode and the sensor ingest shard by
+        # them, and handed-off jobs come back when their receiver leaves
+        client.subscribe(MQTT_TOPIC_MEMBERS, 0)
+        if ASSIGNMENT_MODE == "hash":
+            client.subscribe(MQTT_TOPIC_IN, 0)
+        elif ASSIGNMENT_MODE == "shared":
+            client.subscribe(f"$share/{SHARE_GROUP}/{MQTT_TOPIC_IN}", 0)
+        else:
+            client.subscribe([(MQTT_TOPIC_IN, 0), (MQTT_TOPIC_BIDS, 0), (MQTT_TOPIC_DONE, 0)])
+        if WORK_STEALING:
+            # QoS 1 so handoffs and acks are not dropped on the way in
+            client.subscribe(MQTT_TOPIC_STEAL, 1)
+        if DISTRIBUTED_INGEST:
+            # Every worker sees every sensor message and keeps those of its own shard
+            client.subscribe([(topic, 0) for topic in INGEST_TOPICS])
         client.loop_start()  # Starts a background thread for MQTT
         return client
 
@@ -165,10 +559,12 @@ class DistributedWorker:
         Main entry point that runs in the main thread.
         Initializes components and creates worker threads/processes.
         """
-        print(f"[{self.worker_id}] Starting distributed worker")
+        print(f"[{self.worker_id}] Starting distributed worker (assignment={ASSIGNMENT_MODE})")
         self.client = self.mqtt_subscribe()
         
-        with ProcessPoolExecutor(max_workers=4) as executor:
+        with ProcessPoolExecutor(max_workers=DISTRIBUTED_POOL_SIZE,
+                                 initializer=ModelRegistry.init_worker,
+                                 initargs=(None, DISTRIBUTED_POOL_SIZE)) as executor:
             self.executor = executor
             
             # Start background bid watcher thread
@@ -178,6 +574,9 @@ class DistributedWorker:
                 name="BidWatcher"
             )
             bid_watcher_thread.start()
+
+            threading.Thread(target=self.heartbeat, daemon=True, name="Heartbeat").start()
+            threading.Thread(target=self.batch_dispatcher, daemon=True, name="BatchDispatcher").start()
             
             # Keep the main thread alive
             try:
@@ -185,5 +584,7 @@ class DistributedWorker:
                     time.sleep(0.1)
             except KeyboardInterrupt:
                 print(f"[{self.worker_id}] Shutting down...")
+                self.scheduler.close()
+                self.client.publish(MQTT_TOPIC_MEMBERS, json.dumps({"worker_id": self.worker_id, "status": "offline"}))
                 self.client.loop_stop()
                 self.client.disconnect()
\ No newline at end of file
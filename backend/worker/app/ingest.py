@@ -0,0 +1,262 @@
+import os
+import json
+import base64
+from app.batching import BatchScheduler, DROP_OLDEST, COALESCE
+from app.process_lamness.stream import AccelerometerStreams
+from app.process_images.preprocess_images import parse_camera_frame
+from app.process_audio.audio_frames import is_audio_frame, parse_audio_frame, normalize_bovine_id
+from app.process_audio.reassembly import AudioReassembler
+from app.logging_service import MultiprocessLogger
+
+logger = MultiprocessLogger.get_logger(__name__)
+
+MQTT_TOPIC_MIC = os.getenv("MQTT_TOPIC_MIC", "inference/microphone")
+MQTT_TOPIC_ACC= os.getenv("MQTT_TOPIC_ACC", "inference/accelerometer")
+MQTT_TOPIC_CAMERA = os.getenv("MQTT_TOPIC_CAMERA", "inference/camera")
+# Binary camera frames (see parse_camera_frame); batched with MQTT_TOPIC_CAMERA
+MQTT_TOPIC_CAMERA_RAW = os.getenv("MQTT_TOPIC_CAMERA_RAW", "inference/camera/raw")
+INGEST_TOPICS = [MQTT_TOPIC_MIC, MQTT_TOPIC_ACC, MQTT_TOPIC_CAMERA, MQTT_TOPIC_CAMERA_RAW]
+
+BATCH_TIMEOUT = 500
+
+# Accelerometer readings go through per-bovine streams that emit ready-made
+# feature windows every BATCH_THRESHOLDS["inference/accelerometer"] readings
+ACC_STREAMING = os.getenv("ACC_STREAMING", "true").lower() == "true"
+
+BATCH_THRESHOLDS = {
+    "inference/microphone": int(os.getenv("MIC_BATCH_THRESHOLD", 4)),
+    "inference/accelerometer": 20,
+    "inference/camera": 1
+}
+
+# Topics with a tighter deadline than BATCH_TIMEOUT (seconds)
+BATCH_TIMEOUTS = {
+    "inference/microphone": float(os.getenv("MIC_BATCH_TIMEOUT", 1)),
+}
+
+# Clips from every collar share one microphone queue so a batch can stack
+# many collars into a single model call
+SHARED_QUEUE_ID = "all"
+SHARED_BATCH_TOPICS = {MQTT_TOPIC_MIC}
+
+# Backpressure: bounds on queued messages
+MAX_QUEUED = {
+    "inference/microphone": int(os.getenv("MIC_MAX_QUEUED", 64)),
+    "inference/accelerometer": int(os.getenv("ACC_MAX_QUEUED", 2000)),
+    "inference/camera": int(os.getenv("CAMERA_MAX_QUEUED", 32)),
+}
+MAX_QUEUED_TOTAL = int(os.getenv("MAX_QUEUED_TOTAL", 5000))
+# put() runs in the MQTT network thread, so no topic may BLOCK there: a full
+# microphone queue sheds its oldest clip instead of stalling every topic
+OVERFLOW_POLICIES = {
+    "inference/microphone": DROP_OLDEST,
+    "inference/accelerometer": DROP_OLDEST,
+    "inference/camera": COALESCE,
+}
+
+# Lower runs first: distress audio ahead of lameness ahead of camera/OCR
+TOPIC_PRIORITIES = {
+    "inference/microphone": 0,
+    "inference/accelerometer": 1,
+    "inference/camera": 2,
+}
+
+
+def batch_threshold(topic):
+    # A streamed accelerometer window is already a full batch
+    if topic == MQTT_TOPIC_ACC and ACC_STREAMING:
+        return 1
+    return BATCH_THRESHOLDS[topic]
+
+
+def batch_timeout(topic):
+    return BATCH_TIMEOUTS.get(topic, BATCH_TIMEOUT)
+
+
+def create_scheduler(**kwargs):
+    """
+    A BatchScheduler with the topics' thresholds, timeouts, queue bounds,
+    overflow policies and priorities; `kwargs` add in-flight limits and SLOs.
+    """
+    return BatchScheduler(batch_threshold, batch_timeout,
+                          max_queued=MAX_QUEUED,
+                          max_total=MAX_QUEUED_TOTAL,
+                          policies=OVERFLOW_POLICIES,
+                          priorities=TOPIC_PRIORITIES,
+                          **kwargs)
+
+
+def camera_frame_message(msg):
+    """
+    Builds the camera queue message for a binary frame without copying the image.
+
+    Metadata comes from MQTT v5 user properties when the publisher sets them
+    (the payload is then the bare image), otherwise from the frame header.
+    The payload itself is queued with the offset of the image bytes.
+    """
+    user_properties = dict(getattr(getattr(msg, "properties", None), "UserProperty", None) or [])
+    if "bovine_id" in user_properties:
+        metadata, image_offset = user_properties, 0
+    else:
+        metadata, image_offset = parse_camera_frame(msg.payload)
+    return {
+        **metadata,
+        "topic": MQTT_TOPIC_CAMERA,
+        "image_raw": msg.payload,
+        "image_offset": image_offset,
+    }
+
+
+class SensorIngest:
+    """
+    Turns sensor MQTT messages into scheduler batches.
+
+    Decodes JSON and binary payloads, reassembles microphone clips from their
+    chunks, streams accelerometer readings into feature windows and puts the
+    results on the scheduler under their (topic, bovine_id) batch. Runs in the
+    MQTT client thread; the clip and stream state is per bovine, so all of a
+    bovine's messages must reach the same SensorIngest.
+
+    When `accept` changes (shards rebalanced), a clip stays with the ingest
+    that got its start message: it still takes that clip's chunks, the new
+    owner ignores them and takes over from the next clip. Accelerometer
+    streams are not moved: the new owner starts a fresh stream, so the first
+    window of a moved bovine waits for a full rolling window of readings, and
+    the old stream is evicted once idle (see AccelerometerStreams).
+    """
+
+    def __init__(self, scheduler, worker_id, accept=None):
+        """
+        Args:
+            scheduler (BatchScheduler): Where finished clips, windows and frames are queued.
+            worker_id (str): Prefix for log lines.
+            accept (callable): bovine_id -> bool; messages of other bovines are
+                ignored (e.g. bovines sharded to another node). All by default.
+        """
+        self.scheduler = scheduler
+        self.worker_id = worker_id
+        self.accept = accept
+        self.acc_streams = AccelerometerStreams(hop=BATCH_THRESHOLDS["inference/accelerometer"])
+        self.mic_batch_state = {}  # {bovine_id: AudioReassembler}
+
+    def handle(self, msg):
+        worker_id = self.worker_id
+        try:
+            if msg.topic == MQTT_TOPIC_CAMERA_RAW:
+                message = camera_frame_message(msg)
+                bovine_id = message["bovine_id"] = normalize_bovine_id(message.get("bovine_id"))
+                if bovine_id is None:
+                    logger.error(f"[{worker_id}] Error: Camera frame missing bovine_id field")
+                    return
+                if self.accept is None or self.accept(bovine_id):
+                    self.scheduler.put(MQTT_TOPIC_CAMERA, bovine_id, message)
+                return
+
+            if msg.topic == MQTT_TOPIC_MIC and is_audio_frame(msg.payload):
+                message = parse_audio_frame(msg.payload)
+            else:
+                message = json.loads(msg.payload.decode())
+            if not isinstance(message, dict):
+                logger.error(f"[{worker_id}] Error: Decoded message is not a dictionary: {message}")
+                return
+            topic = msg.topic
+            message["topic"] = topic
+
+            # Same key for an animal whether its id came as a JSON number, a string or a frame header
+            bovine_id = message["bovine_id"] = normalize_bovine_id(message.get("bovine_id"))
+            if topic in [MQTT_TOPIC_MIC, MQTT_TOPIC_ACC, MQTT_TOPIC_CAMERA]:
+                if bovine_id is None:
+                    logger.error(f"[{worker_id}] Error: Message missing bovine_id field")
+                    return
+                owned = self.accept is None or self.accept(bovine_id)
+                if not owned and topic != MQTT_TOPIC_MIC:
+                    return
+
+            if topic == MQTT_TOPIC_MIC:
+                self._handle_mic(topic, bovine_id, message, owned)
+
+            elif topic in [MQTT_TOPIC_ACC, MQTT_TOPIC_CAMERA]:
+                if topic == MQTT_TOPIC_ACC and ACC_STREAMING:
+                    window = self.acc_streams.push(bovine_id, message.get("acclerometer_data") or {})
+                    if window is None:
+                        return
+                    message = {"topic": topic, "bovine_id": bovine_id, **window}
+
+                self.scheduler.put(topic, bovine_id, message)
+
+            else:
+                logger.error(f"[{worker_id}] Error: Unknown topic {topic}")
+
+        except json.JSONDecodeError:
+            logger.error(f"[{worker_id}] Error: Invalid JSON message")
+        except Exception as e:
+            logger.error(f"[{worker_id}] Error processing message: {str(e)}")
+
+    def _handle_mic(self, topic, bovine_id, message, owned=True):
+        worker_id = self.worker_id
+        msg_type = message.get("type")
+
+        clip = self.mic_batch_state.get(bovine_id)
+        if not owned:
+            # Another node owns the bovine now; only finish a clip that started here
+            if msg_type == "start" or clip is None or not clip.is_started:
+                self.mic_batch_state.pop(bovine_id, None)
+                return
+        if clip is None:
+            clip = self.mic_batch_state[bovine_id] = AudioReassembler()
+
+        if msg_type == "start":
+            if "chunks" not in message:
+                logger.warning(f"[{worker_id}] WARNING: Start message for bovine {bovine_id} missing or invalid 'chunks'. Discarding batch.")
+                clip.reset()
+                return
+            if clip.is_started:
+                logger.warning(f"[{worker_id}] WARNING: Received start before previous end for bovine {bovine_id}. Clearing batch.")
+            try:
+                clip.start(message["chunks"], message["timestamp"], message.get("session"))
+            except ValueError as e:
+                logger.warning(f"[{worker_id}] WARNING: Invalid start for bovine {bovine_id}: {e}. Discarding batch.")
+                clip.reset()
+                return
+            logger.info(f"[{worker_id}] Start received for bovine {bovine_id}, expecting {clip.chunks} chunks")
+
+        elif msg_type == "data":
+            if not clip.is_started:
+                logger.warning(f"[{worker_id}] WARNING: Data received before start for bovine {bovine_id}. Ignoring.")
+                return
+            if message.get("session") != clip.session:
+                logger.warning(f"[{worker_id}] WARNING: Chunk from another session for bovine {bovine_id}. Ignoring.")
+                return
+            # Binary frames carry the PCM as is
+            pcm = message["pcm"] if "pcm" in message else base64.b64decode(message["data"])
+            try:
+                if not clip.add(message["index"], pcm):
+                    logger.warning(f"[{worker_id}] WARNING: Duplicate chunk {message['index']} for bovine {bovine_id}. Ignoring.")
+            except ValueError as e:
+                logger.warning(f"[{worker_id}] WARNING: Invalid chunk for bovine {bovine_id}: {e}. Clearing batch.")
+                clip.reset()
+
+        elif msg_type == "end":
+            if not clip.is_started:
+                logger.warning(f"[{worker_id}] WARNING: End received before start for bovine {bovine_id}. Ignoring.")
+                return
+            chunks, timestamp = clip.chunks, clip.timestamp
+            missing = clip.missing()
+            joined_audio = clip.finish()
+            if joined_audio is not None:
+                logger.info(f"[{worker_id}] End received for bovine {bovine_id}. Preparing to queue batch.")
+                batch = {
+                    "topic": topic,
+                    "bovine_id": bovine_id,
+                    "batch_size": chunks,
+                    "timestamp": timestamp,
+                    "data": joined_audio
+                }
+                self.scheduler.put(topic, SHARED_QUEUE_ID if topic in SHARED_BATCH_TOPICS else bovine_id, batch)
+                logger.info(f"[{worker_id}] Valid batch queued for bovine {bovine_id}")
+            else:
+                logger.warning(f"[{worker_id}] WARNING: Invalid batch for bovine {bovine_id}: missing {len(missing)} of {chunks} chunks (first {missing[:5]}). Clearing batch.")
+                clip.reset()
+
+        else:
+            logger.warning(f"[{worker_id}] WARNING: Unknown message type '{msg_type}' for bovine {bovine_id}")
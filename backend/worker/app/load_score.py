@@ -0,0 +1,108 @@
+import os
+from threading import Lock
+import psutil
+
+# Weight of the newest sample in the smoothed CPU and service times
+SCORE_SMOOTHING = float(os.getenv("SCORE_SMOOTHING", 0.3))
+# Service time assumed for a topic this node has not run yet (seconds)
+DEFAULT_SERVICE_TIME = float(os.getenv("DEFAULT_SERVICE_TIME", 1.0))
+# Extra seconds for a topic whose models this node's pool does not preload
+COLD_START_PENALTY = float(os.getenv("COLD_START_PENALTY", 5.0))
+# Above this memory use a node bids as if it were MEMORY_PENALTY seconds behind
+MEMORY_LIMIT_PERCENT = float(os.getenv("MEMORY_LIMIT_PERCENT", 90))
+MEMORY_PENALTY = 60.0
+
+
+class LoadScorer:
+    """
+    Estimates how many seconds this node would take to finish a job of a topic.
+
+    The estimate is the wait for a free pool process (jobs queued and in
+    flight, at the node's recent mean service time, spread over the pool),
+    plus the topic's own recent service time, stretched by the smoothed CPU
+    load, plus a cold-start penalty while the topic's models are not loaded
+    (not preloaded by the pool and no job of the topic has run yet).
+    Lower is better, so it can be used directly as the auction bid.
+    """
+
+    def __init__(self, pool_size, warm_topics=()):
+        """
+        Args:
+            pool_size (int): Processes in the node's pool.
+            warm_topics (iterable): Topics whose models the pool preloads (see preloaded_topics).
+        """
+        self.pool_size = pool_size
+        self.lock = Lock()
+        self.in_flight = 0
+        self.queued = 0
+        self.service_times = {}  # {topic: smoothed seconds}
+        self.warm_topics = set(warm_topics)
+        self.cpu = None
+        self.memory = 0.0
+
+    def _smooth(self, old, new):
+        return new if old is None else old + SCORE_SMOOTHING * (new - old)
+
+    def sample(self):
+        """Samples CPU and memory; call periodically (cpu_percent measures since the last call)."""
+        cpu = psutil.cpu_percent(interval=None)
+        memory = psutil.virtual_memory().percent
+        with self.lock:
+            self.cpu = self._smooth(self.cpu, cpu)
+            self.memory = memory
+
+    def job_queued(self):
+        with self.lock:
+            self.queued += 1
+
+    def job_started(self):
+        """A queued job was submitted to the pool."""
+        with self.lock:
+            self.queued = max(0, self.queued - 1)
+            self.in_flight += 1
+
+    def job_handed_off(self, count=1):
+        """Queued jobs were given to another node."""
+        with self.lock:
+            self.queued = max(0, self.queued - count)
+
+    def free_slots(self):
+        """Pool processes not running a job of this node."""
+        with self.lock:
+            return max(0, self.pool_size - self.in_flight)
+
+    def job_finished(self, topic, service_time=None):
+        """A submitted job finished; `service_time` is how long the pipeline ran."""
+        with self.lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            if service_time is not None and topic is not None:
+                self.service_times[topic] = self._smooth(self.service_times.get(topic), service_time)
+                self.warm_topics.add(topic)
+
+    def score(self, topic):
+        """Estimated seconds until a new job of `topic` would be finished here."""
+        with self.lock:
+            service_time = self.service_times.get(topic, DEFAULT_SERVICE_TIME)
+            mean_service = (sum(self.service_times.values()) / len(self.service_times)
+                            if self.service_times else DEFAULT_SERVICE_TIME)
+            # Jobs that have to finish before ours gets a process
+            ahead = max(0, self.queued + self.in_flight - self.pool_size + 1)
+            wait = ahead * mean_service / self.pool_size
+            slowdown = 1.0 / max(0.1, 1.0 - (self.cpu or 0.0) / 100.0)
+
+            estimate = (wait + service_time) * slowdown
+            if topic not in self.warm_topics:
+                estimate += COLD_START_PENALTY
+            if self.memory > MEMORY_LIMIT_PERCENT:
+                estimate += MEMORY_PENALTY
+            return estimate
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queued": self.queued,
+                "in_flight": self.in_flight,
+                "cpu": self.cpu,
+                "memory": self.memory,
+                "service_times": dict(self.service_times),
+            }
@@ -3,15 +3,14 @@ load_dotenv()
 
 import os
 import time
-import queue
-import json
 import uuid
-from concurrent.futures import ProcessPoolExecutor
+import threading
+from contextlib import ExitStack
 import paho.mqtt.client as mqtt
 from app.distributed_worker import DistributedWorker
 from app.database.db import init_db
-from threading import Lock
-import base64
+from app.model_registry import WORKER_POOL_SIZE, TOPIC_MODELS, create_worker_pool
+from app.ingest import INGEST_TOPICS, create_scheduler, SensorIngest
 
 # Add parent directory to sys.path
 import sys
@@ -24,52 +23,47 @@ logger = MultiprocessLogger.get_logger("MainApp")
 
 MQTT_BROKER = os.getenv("MQTT_BROKER", "mosquitto")
 MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))
-MQTT_TOPIC_MIC = os.getenv("MQTT_TOPIC_MIC", "inference/microphone")
-MQTT_TOPIC_ACC= os.getenv("MQTT_TOPIC_ACC", "inference/accelerometer")
-MQTT_TOPIC_CAMERA = os.getenv("MQTT_TOPIC_CAMERA", "inference/camera")
-IS_DISTRIBUTED = False
+IS_DISTRIBUTED = os.getenv("IS_DISTRIBUTED", "false").lower() == "true"
 CHUNK_SIZE = None
 
-BATCH_TIMEOUT = 500
-# mic_request_count = 0
-mic_batch_state = {}  # {bovine_id: {"is_started": False, "data_count": 0}}
-
-BATCH_THRESHOLDS = {
-    "inference/microphone": 1,  
-    "inference/accelerometer": 20,
-    "inference/camera": 1
+# One process pool per topic, sized to its pipeline's cost, that preloads only
+# that topic's models. With DEDICATED_POOLS=false all topics share one
+# WORKER_POOL_SIZE pool holding every model.
+DEDICATED_POOLS = os.getenv("DEDICATED_POOLS", "true").lower() == "true"
+TOPIC_POOL_SIZES = {
+    "inference/microphone": int(os.getenv("MIC_POOL_SIZE", 1)),
+    "inference/accelerometer": int(os.getenv("ACC_POOL_SIZE", 1)),
+    "inference/camera": int(os.getenv("CAMERA_POOL_SIZE", 2)),
+}
+# Batches a pool process runs before it is replaced (0: never), to bound leaks
+MAX_TASKS_PER_CHILD = int(os.getenv("MAX_TASKS_PER_CHILD", 0))
+
+# Batches handed to the pools at once. Kept at the pool size so queued work
+# waits in the scheduler, where priorities apply, not in the pool's FIFO
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", sum(TOPIC_POOL_SIZES.values()) if DEDICATED_POOLS else WORKER_POOL_SIZE))
+# In-flight slots kept free for a topic, so one pool process is always ready for audio
+RESERVED_SLOTS = {
+    "inference/microphone": int(os.getenv("MIC_RESERVED_SLOTS", 1)),
+}
+# Latency targets (seconds from the first message of a batch to its result)
+LATENCY_SLOS = {
+    "inference/microphone": float(os.getenv("MIC_LATENCY_SLO", 3)),
+    "inference/accelerometer": float(os.getenv("ACC_LATENCY_SLO", 30)),
+    "inference/camera": float(os.getenv("CAMERA_LATENCY_SLO", 60)),
 }
 
-WORKER_ID = str(uuid.uuid4())
-
-class ThreadSafeQueueManager:
-    def __init__(self):
-        self.queues = {}
-        self.lock = Lock()
-        self.last_process_times = {}
-        self.mic_batches = {}  # {(bovine_id): {"start": msg, "chunks": [], "ended": False}}
-
-    def get_or_create_queue(self, topic, bovine_id):
-        key = (topic, bovine_id)
-        with self.lock:
-            if key not in self.queues:
-                self.queues[key] = queue.Queue()
-                self.last_process_times[key] = time.time()
-            return self.queues[key]
-
-    def get_last_process_time(self, topic, bovine_id):
-        with self.lock:
-            return self.last_process_times.get((topic, bovine_id), time.time())
-
-    def update_last_process_time(self, topic, bovine_id):
-        with self.lock:
-            self.last_process_times[(topic, bovine_id)] = time.time()
+# How often shed messages are reported (seconds); shedding happens in the MQTT
+# thread, so it is reported from a timer rather than from the batch loop
+BACKPRESSURE_REPORT_INTERVAL = float(os.getenv("BACKPRESSURE_REPORT_INTERVAL", 5))
 
-    def get_all_queues(self):
-        with self.lock:
-            return list(self.queues.items())
+WORKER_ID = str(uuid.uuid4())
 
-queue_manager = ThreadSafeQueueManager()
+queue_manager = create_scheduler(max_in_flight=MAX_IN_FLIGHT,
+                                 # A dedicated pool already reserves its processes for its topic
+                                 reserved={} if DEDICATED_POOLS else RESERVED_SLOTS,
+                                 limits=TOPIC_POOL_SIZES if DEDICATED_POOLS else None,
+                                 slos=LATENCY_SLOS)
+ingest = SensorIngest(queue_manager, WORKER_ID)
 
 def   run_inference_and_publish(messages):
     """
@@ -117,118 +111,47 @@ def   run_inference_and_publish(messages):
     return result
 
 def on_message(client, userdata, msg):
-    try:
-        message = json.loads(msg.payload.decode())
-        if not isinstance(message, dict):
-            logger.error(f"[{WORKER_ID}] Error: Decoded message is not a dictionary: {message}")
-            return
-        topic = msg.topic
-        message["topic"] = topic
-
-        if topic == MQTT_TOPIC_MIC:
-            bovine_id = message.get("bovine_id")
-            msg_type = message.get("type")
-
-            if bovine_id is None:
-                logger.error(f"[{WORKER_ID}] Error: Message missing bovine_id field")
-                return
-
-            # Initialize state if not present
-            if bovine_id not in mic_batch_state:
-                mic_batch_state[bovine_id] = {"is_started": False, "data_count": 0, "data": [],"start_at": None,"chunk_size":0}
-
-            state = mic_batch_state[bovine_id]
+    ingest.handle(msg)
 
-            if msg_type == "start":
-                if "chunks" in message:
-                    state["chunk_size"] =  message["chunks"]
-                    chunk = state["chunk_size"] 
-                    logger.info(f"[{WORKER_ID}] CHUNK_SIZE set to {chunk } for bovine {bovine_id}")
-                else:
-                    logger.warning(f"[{WORKER_ID}] WARNING: Start message for bovine {bovine_id} missing or invalid 'chunks'. Discarding batch.")
-                    state["is_started"] = False
-                    state["data"] = []
-                    state["data_count"] = 0
-                    state["chunk_size"]=0
-                    return
-                if state["is_started"]:
-                    logger.warning(f"[{WORKER_ID}] WARNING: Received start before previous end for bovine {bovine_id}. Clearing batch.")
-                    state["data"] = []
-                    state["data_count"] = 0
-                state["is_started"] = True
-                state["data"] = []
-                state["data_count"] = 0
-                state["start_at"] = message["timestamp"]
-                logger.info(f"[{WORKER_ID}] Start received for bovine {bovine_id}")
-
-            elif msg_type == "data":
-                if not state["is_started"]:
-                    logger.warning(f"[{WORKER_ID}] WARNING: Data received before start for bovine {bovine_id}. Ignoring.")
-                    return
-                # Store both index and data for sorting later
-                state["data"].append({"index": message["index"], "data": message["data"]})
-                logger.info(f"[{WORKER_ID}] Data received for bovine {bovine_id}. Total data count: {state['data_count'] + 1}")
-                state["data_count"] += 1
-                if state["data_count"] > state["chunk_size"] :
-                    logger.warning(f"[{WORKER_ID}] WARNING: More than chunk_size data messages for bovine {bovine_id}. Clearing batch.")
-                    state["is_started"] = False
-                    state["data"] = []
-                    state["data_count"] = 0
-
-            elif msg_type == "end":
-                if not state["is_started"]:
-                    logger.warning(f"[{WORKER_ID}] WARNING: End received before start for bovine {bovine_id}. Ignoring.")
-                    return
-                if state["data_count"] == state["chunk_size"] :
-                    logger.info(f"[{WORKER_ID}] End received for bovine {bovine_id}. Preparing to queue batch.")
-                    joined_audio = b''.join(
-                        base64.b64decode(item["data"]) for item in sorted(state["data"], key=lambda x: x["index"])
-                    )
-                    # print("item _data", state["data")
-                    batch = {
-                        "topic": topic,
-                        "bovine_id": bovine_id,
-                        "batch_size": state["data_count"],
-                        "timestamp": state["start_at"],
-                        "data": joined_audio
-                    }
-                    q = queue_manager.get_or_create_queue(topic, bovine_id)
-                    q.put(batch)
-                    logger.info(f"[{WORKER_ID}] Valid batch queued for bovine {bovine_id}")
-                else:
-                    logger.warning(f"[{WORKER_ID}] WARNING: Invalid batch for bovine {bovine_id}: expected chunk_size data, got {state['data_count']}. Clearing batch.")
-                # Reset state
-                state["is_started"] = False
-                state["data"] = []
-                state["data_count"] = 0
-
-            else:
-                logger.warning(f"[{WORKER_ID}] WARNING: Unknown message type '{msg_type}' for bovine {bovine_id}")
-
-        # Handle other topics as before...
-        elif topic in [MQTT_TOPIC_ACC, MQTT_TOPIC_CAMERA]:
-            bovine_id = message.get("bovine_id")
-            if bovine_id is None:
-                logger.error(f"[{WORKER_ID}] Error: Message missing bovine_id field")
-                return
-            
-            q = queue_manager.get_or_create_queue(topic, bovine_id)
-            q.put(message)
-            # logger.info(f"[{WORKER_ID}] Queued message from {topic} for bovine {bovine_id}")
-
-        else:
-            logger.error(f"[{WORKER_ID}] Error: Unknown topic {topic}")
-
-    except json.JSONDecodeError:
-        logger.error(f"[{WORKER_ID}] Error: Invalid JSON message")
-    except Exception as e:
-        logger.error(f"[{WORKER_ID}] Error processing message: {str(e)}")
+def create_pools(stack):
+    """
+    Returns:
+        dict: {topic: executor}; every topic maps to the same pool unless DEDICATED_POOLS.
+    """
+    if not DEDICATED_POOLS:
+        pool = stack.enter_context(create_worker_pool(WORKER_POOL_SIZE, max_tasks_per_child=MAX_TASKS_PER_CHILD))
+        return {topic: pool for topic in TOPIC_POOL_SIZES}
+
+    total_processes = sum(TOPIC_POOL_SIZES.values())
+    pools = {}
+    for topic, size in TOPIC_POOL_SIZES.items():
+        pools[topic] = stack.enter_context(create_worker_pool(size, TOPIC_MODELS[topic], total_processes,
+                                                              MAX_TASKS_PER_CHILD))
+        logger.info(f"[{WORKER_ID}] {size} process pool for {topic}, preloading {TOPIC_MODELS[topic]}")
+    return pools
+
+def batch_done(topic, opened):
+    latency = queue_manager.done(topic, opened)
+    slo = LATENCY_SLOS.get(topic)
+    if slo is not None and latency > slo:
+        logger.warning(f"[{WORKER_ID}] {topic} batch took {latency:.2f}s, over its {slo}s SLO")
+
+def report_backpressure():
+    shed_reported = 0
+    while True:
+        time.sleep(BACKPRESSURE_REPORT_INTERVAL)
+        stats = queue_manager.stats()
+        if stats["shed_total"] != shed_reported:
+            logger.warning(f"[{WORKER_ID}] Backpressure: shed {stats['shed_total'] - shed_reported} messages "
+                           f"in {BACKPRESSURE_REPORT_INTERVAL:g}s (totals {stats['shed']}), queued {stats['queued']}")
+            shed_reported = stats["shed_total"]
 
 def mqtt_subscribe():
-    client = mqtt.Client()
+    # MQTT v5, so camera frames can carry their metadata as user properties
+    client = mqtt.Client(protocol=mqtt.MQTTv5)
     client.on_message = on_message
     client.connect(MQTT_BROKER, MQTT_PORT,clean_start=mqtt.MQTT_CLEAN_START_FIRST_ONLY)
-    client.subscribe([(MQTT_TOPIC_MIC, 0), (MQTT_TOPIC_ACC, 0), (MQTT_TOPIC_CAMERA, 0)])
+    client.subscribe([(topic, 0) for topic in INGEST_TOPICS])
     client.loop_start()
     return client
 
@@ -241,37 +164,27 @@ def main():
         worker.start()
     else:
         client = mqtt_subscribe()
-        with ProcessPoolExecutor(max_workers=3) as executor:
+        with ExitStack() as stack:
+            pools = create_pools(stack)
+            threading.Thread(target=report_backpressure, daemon=True).start()
             while True:
                 try:
-                    for (topic, bovine_id), q in queue_manager.get_all_queues():
-                        curr_time = time.time()
-                        last_process_time = queue_manager.get_last_process_time(topic, bovine_id)
-
-                        should_process = (
-                            not q.empty() and
-                            (q.qsize() >= BATCH_THRESHOLDS[topic] or 
-                             curr_time - last_process_time >= BATCH_TIMEOUT)
-                        )
-
-                        if should_process:
-                            logger.info(f"[{WORKER_ID}] Triggering batch process for topic {topic}, bovine {bovine_id}")
-                            messages = []
-                            try:
-                                while not q.empty():
-                                    message = q.get_nowait()
-                                    messages.append(message)
-                                    q.task_done()
-                            except queue.Empty:
-                                pass
-
-                            executor.submit(run_inference_and_publish, messages)
-                            queue_manager.update_last_process_time(topic, bovine_id)
+                    # Waits for a due batch whose topic has a free in-flight slot
+                    batch = queue_manager.next_batch()
+                    if batch is None:
+                        break
+                    topic, bovine_id, messages, opened = batch
+                    logger.info(f"[{WORKER_ID}] Triggering batch process for topic {topic}, bovine {bovine_id} "
+                                f"(queue wait {time.monotonic() - opened:.3f}s)")
+                    try:
+                        future = pools[topic].submit(run_inference_and_publish, messages)
+                    except Exception:
+                        queue_manager.done(topic, opened)
+                        raise
+                    future.add_done_callback(lambda _, topic=topic, opened=opened: batch_done(topic, opened))
 
                 except Exception as e:
                     logger.error(f"[{WORKER_ID}] Main loop error: {str(e)}", exc_info=True)
 
-                time.sleep(1)
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
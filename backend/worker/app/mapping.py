@@ -2,16 +2,14 @@
 # HENCE ITS BETTER TO JUST IMPORT INSIDE FUNCTIONS AND **NOT HAVE GLOBAL SCOPE** TO MAKE SURE THERE ARE NO LOCK ISSUES
 
 from enum import Enum
-from PIL import Image
-import librosa
 import numpy as np
 import os
-import wave
-import onnxruntime as ort
 from datetime import datetime
 from app.database.db import db_session
 from app.database.models import DistressCall, FeedingPatterns, SMSAlerts
 from app.alerts import send_sms_alert
+from app.model_registry import ModelRegistry, run_batched
+from app.process_audio.preprocess_audio import decode_pcm, extract_audio_features, scale_melspec, melspec_input_tensor
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -25,87 +23,29 @@ class Predictions(Enum):
     HFC = "HFC"
     LFC = "LFC"
 
-def scale_melspec(mel_spec):
-    target_size = (90, 200)
-    norm_spec = librosa.util.normalize(mel_spec)
-    norm_spec = (norm_spec * 255).astype(np.uint8)
-    img = Image.fromarray(norm_spec)
-    img = img.resize(target_size, Image.Resampling.LANCZOS)
-    img_array = np.array(img)
-    return img_array
 
-import librosa
-
-# def scale_melspec(mel_spec):
-#     target_size = (90, 200)
-    
-#     # Log-scale and clip the values
-#     mel_spec = librosa.util.normalize(mel_spec)
-    
-#     # Clip to valid range [-1, 1]
-#     mel_spec = np.clip(mel_spec, -1, 1)
-
-#     # Replace NaNs and infs
-#     mel_spec = np.nan_to_num(mel_spec, nan=0.0, posinf=1.0, neginf=-1.0)
-
-#     # Rescale to [0, 255]
-#     mel_spec = ((mel_spec + 1) / 2) * 255
-#     mel_spec = mel_spec.astype(np.uint8)
-
-#     img = Image.fromarray(mel_spec)
-#     img = img.resize(target_size, Image.Resampling.LANCZOS)
-#     img_array = np.array(img)
-
-#     return img_array
-
-
-
-    
-# def predict_from_wav(Model,WAV):
-#     y, sr = librosa.load(WAV)
-#     mel_spec = librosa.feature.melspectrogram(y=y, sr=sr, n_fft=2048, hop_length=512, n_mels=90)
-#     log_mel_spec = librosa.power_to_db(mel_spec)
-#     scaled_mel_spec = scale_melspec(log_mel_spec)
-
-#         # Shape it to model input: (1, H, W, 3)
-#     input_tensor = np.repeat(scaled_mel_spec[..., np.newaxis], 3, axis=-1)
-#     input_tensor = np.expand_dims(input_tensor, axis=0)
-
-#     print("Input tensor generated")
-
-#     print("Input shape:", input_tensor.shape)
-#     print("Model input shape:", Model.input_shape)
-
-#     prediction = Model.predict(input_tensor, verbose=1)
-
-#     print("Prediction made")
+def predict_batch_from_features(ModelPath, features_list):
+    """
+    Run the distress model once over the clips in `features_list`.
 
-#     pred_class = np.argmax(prediction)
-#     confidence = float(np.max(prediction))
-#     print("Predicted class:", pred_class, "with confidence:", confidence)
-#     if pred_class == 1:
-#         return Predictions.HFC, confidence
-#     elif pred_class == 0:
-#         return Predictions.LFC, confidence
-def predict_from_wav(ModelPath, WAV):
+    Returns:
+        list: One (Predictions, confidence) tuple per clip, (None, None) for all clips on error.
+    """
     try:
-        y, sr = librosa.load(WAV)
-        mel_spec = librosa.feature.melspectrogram(y=y, sr=sr, n_fft=2048, hop_length=512, n_mels=90)
-        log_mel_spec = librosa.power_to_db(mel_spec)
-        scaled_mel_spec = scale_melspec(log_mel_spec)
-        # Shape it to model input: (1, H, W, 3)
-        input_tensor = np.repeat(scaled_mel_spec[..., np.newaxis], 3, axis=-1)
-        input_tensor = np.expand_dims(input_tensor, axis=0).astype(np.float32)
+        log_mels = [features.log_mel for features in features_list]
+        if len({log_mel.shape for log_mel in log_mels}) == 1:
+            scaled_mel_specs = scale_melspec(np.stack(log_mels))
+        else:
+            scaled_mel_specs = np.stack([scale_melspec(log_mel) for log_mel in log_mels])
+        # Shape it to model input: (N, H, W, 3)
+        input_tensor = melspec_input_tensor(scaled_mel_specs)
 
         logger.info("Input tensor generated for model inference.")
         logger.info(f"Input shape: {input_tensor.shape}")
 
-        # Load ONNX model and run inference
-        session = ort.InferenceSession(ModelPath)
-        input_name = session.get_inputs()[0].name
-        logger.info(f"Model input name: {input_name}")
-
-        prediction = session.run(None, {input_name: input_tensor})[0]
+        # Reuse the process-resident session for the model
+        session = ModelRegistry.load_session(ModelPath)
+        prediction = run_batched(session, input_tensor)[0]
 
         # logger.info("Prediction made.")
         # logger.info(f"Prediction : {prediction}")
@@ -120,20 +60,23 @@ def predict_from_wav(ModelPath, WAV):
         logger.info("Prediction made.")
         logger.info(f"Prediction : {prediction}")
 
-        score = float(prediction[0][0])  # Probability of class 1
-        pred_class = 1 if score >= 0.5 else 0
-        confidence = score if pred_class == 1 else 1 - score
+        results = []
+        for score in np.asarray(prediction, dtype=np.float32)[:, 0]:  # Probability of class 1
+            score = float(score)
+            pred_class = 1 if score >= 0.5 else 0
+            confidence = score if pred_class == 1 else 1 - score
 
-        logger.info(f"Predicted class: {pred_class} with confidence: {confidence:.4f}")
+            logger.info(f"Predicted class: {pred_class} with confidence: {confidence:.4f}")
 
-        if pred_class == 1:
-            return Predictions.HFC, confidence
-        else:
-            return Predictions.LFC, confidence
+            if pred_class == 1:
+                results.append((Predictions.HFC, confidence))
+            else:
+                results.append((Predictions.LFC, confidence))
+        return results
 
     except Exception as e:
         logger.error(f"Error during model inference: {e}", exc_info=True)
-        return None, None
+        return [(None, None)] * len(features_list)
 
 def validate_batch(batch_data):
     """Validate that all messages in batch are from same bovine and have required fields"""
@@ -146,68 +89,13 @@ def validate_batch(batch_data):
             return False, f"Mismatched bovine_ids in batch: {msg['bovine_id']} != {bovine_id}"
     return True, None
 
-    # Helper functions
-# def save_raw_to_wav(raw_data, output_wav_path, sample_rate=22050):
-#     with wave.open(output_wav_path, 'wb') as wf:
-#         wf.setnchannels(1)        # Mono
-#         wf.setsampwidth(2)         # 16 bits = 2 bytes
-#         wf.setframerate(sample_rate)
-#         if isinstance(raw_data, list):
-#             raw_data = bytes(raw_data)
-#         wf.writeframes(raw_data)
-
-def save_raw_to_wav(raw_chunks, output_wav_path, sample_rate=22050):
-
-    # WAV file settings — must match ESP32 recording config
-    sample_rate = 22500
-    sample_width = 2  # bytes (16 bits)
-    channels = 1
-
-    import base64
-    try:
-        # raw_bytes = map(lambda chunk: base64.b64decode(chunk), raw_chunks)
-        # # Step 1: Join all chunks (strings) into one bytes object
-        # # raw_bytes = b''.join(chunk.encode('latin1') for chunk in raw_chunks)
-        # raw_bytes = b''.join(raw_bytes)
-        raw_bytes = raw_chunks
-
-        # Step 2: Save as WAV
-        with wave.open(output_wav_path, 'wb') as wf:
-            wf.setnchannels(channels)        # Mono
-            wf.setsampwidth(sampwidth=sample_width)        # 16-bit PCM
-            wf.setframerate(sample_rate)
-            wf.writeframes(raw_bytes)
-
-        logger.info(f"Saved raw audio to {output_wav_path}")
-    except Exception as e:
-        logger.error(f"Error saving raw audio to {output_wav_path}: {e}", exc_info=True)
-
-
-def extract_mfcc(y, sr, n_mfcc=13, hop_length=256, n_fft=1024):
-    mfcc_feat = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=n_mfcc,
-                                    hop_length=hop_length, n_fft=n_fft)
-    return mfcc_feat.astype(np.float32)
-
-def process_audio(filepath, sr=22050):
-    y, _ = librosa.load(filepath, sr=sr)
-    mfcc = extract_mfcc(y, sr)
-    if mfcc.shape[1] < 128:
-        pad_width = 128 - mfcc.shape[1]
-        mfcc = np.pad(mfcc, ((0, 0), (0, pad_width)), mode='constant')
-    else:
-        mfcc = mfcc[:, :128]
-    feature = mfcc.flatten()
-    feature = feature.astype(np.float32)
-    feature = np.expand_dims(feature, axis=0)
-    return feature
-
-def run_inference(onnx_model_path, audio_path):
-    session = ort.InferenceSession(onnx_model_path, providers=["CPUExecutionProvider"])
-    input_name = session.get_inputs()[0].name
-    input_feature = process_audio(audio_path)
-    outputs = session.run(None, {input_name: input_feature})
-    predicted_class = outputs[0][0]
-    return predicted_class
+def run_batch_inference_on_features(onnx_model_path, features_list):
+    """Run the bite/chew model once over the clips and return one class per clip."""
+    session = ModelRegistry.load_session(onnx_model_path)
+    input_features = np.concatenate([features.mfcc_vector() for features in features_list])
+    outputs = run_batched(session, input_features)
+    predicted_classes = [int(predicted_class) for predicted_class in outputs[0]]
+    return predicted_classes
 
 
 
@@ -233,27 +121,36 @@ def microphone_pipeline(batch_data):
     try:
         predictions = []
         # print("*****", batch_data['data'])
+        clips = []
         for message in batch_data['data']:
             bovine_id = message['bovine_id']
             logger.info(f"Processing message for Bovine {bovine_id}")
             # timestamp = datetime.strptime(message['timestamp'], "%Y-%m-%dT%H:%M:%S.%f")  # Assume ISO format
             timestamp = message['timestamp']
             logger.info(f"Timestamp for Bovine {bovine_id}: {timestamp}")
-            # Save raw audio to wav
+            # Decode the PCM once in memory; the same features feed both models.
+            # Clips of other collars share the batch, so a bad clip is only skipped
+            try:
+                y, sr = decode_pcm(message['data'])
+                clips.append((bovine_id, timestamp, extract_audio_features(y, sr)))
+            except Exception as e:
+                logger.error(f"Skipping invalid clip for Bovine {bovine_id} at {timestamp}: {e}", exc_info=True)
 
-            temp_wav_path = f"./tmp/{bovine_id}_{timestamp}.wav"
-            os.makedirs("./tmp", exist_ok=True)
-            logger.info("Saving raw audio to wav: %s", temp_wav_path)
-    
-            # message['data'] = [ chunk for chunk in sorted(message['data'], key=lambda x: x['index']) ]
-            save_raw_to_wav(message['data'], temp_wav_path)
-            logger.info("Saved raw audio to wav chunk: %s", temp_wav_path)
+        if not clips:
+            return {"status": "success", "predictions": predictions}
+
+        # Stack every clip in the batch and run each model once
+        features_list = [features for _, _, features in clips]
+        logger.info("Running inference(bite-chew) on %d clips", len(clips))
+        bite_chew_preds = run_batch_inference_on_features(onnx_model_path, features_list)
+        logger.info("Inference result: %s", bite_chew_preds)
 
-            # Inference
-            logger.info("Running inference(bite-chew) on wav file: %s", temp_wav_path)
-            pred = run_inference(onnx_model_path, temp_wav_path)
-            logger.info("Inference result: %s", pred)
+        # Inference with Keras model (HFC / LFC)
+        distress_model = os.getenv("DISTRESS_MODEL_PATH")
+        distress_preds = predict_batch_from_features(distress_model, features_list)
 
+        # Scatter the per-clip results back to their rows
+        for (bovine_id, timestamp, _), pred, (frequency_class, probability) in zip(clips, bite_chew_preds, distress_preds):
             # label_idx = int(np.argmax(pred))
             # print(label_idx)
             label = LABELS.get(pred, "unknown")
@@ -261,9 +158,6 @@ def microphone_pipeline(batch_data):
             predictions.append((timestamp, label))
             logger.info(f"Predicted label for Bovine {bovine_id} at {timestamp}: {label}")
 
-            # Inference with Keras model (HFC / LFC)
-            distress_model = os.getenv("DISTRESS_MODEL_PATH")
-            frequency_class, probability = predict_from_wav(distress_model,temp_wav_path)
             logger.info(f"Distress model prediction for Bovine {bovine_id} at {timestamp}: {frequency_class}, Probability: {probability}")
             if frequency_class == Predictions.HFC: # or frequency_class  Predictions.LFC:
                 distress_call = DistressCall(
@@ -286,10 +180,6 @@ def microphone_pipeline(batch_data):
 
                 db.add(sms_alert)
 
-            # Cleanup
-            os.remove(temp_wav_path)
-            logger.info("Removed temporary wav file: %s", temp_wav_path)
-
             feeding_pattern = FeedingPatterns(
                 bovine_id=bovine_id,
                 timestamp=timestamp,
@@ -304,13 +194,13 @@ def microphone_pipeline(batch_data):
 
     except Exception as e:
         db.rollback()
-        logger.error(f"Error processing microphone batch: {e.with_traceback()}", exc_info=True)
+        logger.error(f"Error processing microphone batch: {e}", exc_info=True)
         return {"status": "error", "message": str(e)}
     finally:
         db.close()
 
 def accelerometer_pipeline(batch_data):
-    from app.process_lamness.preprocess_lamness import predict_lameness
+    from app.process_lamness.preprocess_lamness import predict_lameness, predict_lameness_window
     from app.alerts import _get_bovin_name_from_db
     from app.database.models import LamenessInference,Bovine
     
@@ -323,7 +213,7 @@ def accelerometer_pipeline(batch_data):
         for message in batch_data['data']:
             if 'acclerometer_data' in message:
                 combined_data["acclerometer_data"].append(message['acclerometer_data'])  # append dict
-            else:
+            elif 'lameness_features' not in message:
                 logger.warning(f"Missing 'acclerometer_data' in message: {message}")
 
         # print(f"Combined acclerometer_data data: {combined_data}", flush=True)
@@ -333,10 +223,17 @@ def accelerometer_pipeline(batch_data):
         timestamp = datetime.now().isoformat()
         logger.info(f"Processing acclerometer_data message for Bovine {bovine_id} at {timestamp}")
         
+        # Streamed windows already carry their features (see process_lamness.stream);
+        # windows overlap, so the newest one covers the latest readings
+        windows = [message for message in batch_data['data'] if 'lameness_features' in message]
+
         # Predict lameness
         try:
             # print("Calling predict_lameness with data:", combined_data, flush=True)
-            results = predict_lameness(combined_data)
+            if windows:
+                results = predict_lameness_window(windows[-1])
+            else:
+                results = predict_lameness(combined_data)
             if results is not None and isinstance(results, dict):
                 prediction = results.get("prediction")
                 steps = results.get("steps")
@@ -403,7 +300,9 @@ def camera_pipeline(batch_data):
     logger.info("Camera pipeline triggered ✅")
 
     try:
-        
+        # Detect cows in every frame first so all crops of the batch are
+        # classified in one disease-model call
+        frames = []
         for messages in batch_data['data']:
             try:
                 # Process each message in the batch
@@ -418,13 +317,24 @@ def camera_pipeline(batch_data):
                 logger.info(f"Processing camera message at {timestamp}")
 
                 # Detect cows in the image
-                detected_cows = detect_cows(messages['image_raw'])
+                detected_cows = detect_cows(messages['image_raw'], messages.get('image_offset', 0))
                 if not detected_cows:
                     logger.info(f"No cows detected for Bovine {bovine_id} at {timestamp}")
                     continue
+                frames.append((bovine_id, timestamp, detected_cows))
+            except Exception as e:
+                logger.error(f"Error processing message for Bovine {bovine_id}: {e}", exc_info=True)
 
-                # Detect diseases in the detected cows
-                diseases = batch_detect_diseases(detected_cows)
+        all_cows = [cow for _, _, detected_cows in frames for cow in detected_cows]
+        all_diseases = batch_detect_diseases(all_cows)
+
+        first_crop = 0
+        for bovine_id, timestamp, detected_cows in frames:
+            try:
+                # Diseases found among this frame's crops
+                last_crop = first_crop + len(detected_cows)
+                diseases = [d for d in all_diseases if first_crop <= d['crop_index'] < last_crop]
+                first_crop = last_crop
                 if not diseases:
                     logger.info(f"No diseases detected for Bovine {bovine_id} at {timestamp}")
                     continue
@@ -0,0 +1,194 @@
+import os
+from dotenv import load_dotenv
+from app.logging_service import MultiprocessLogger
+
+load_dotenv()
+logger = MultiprocessLogger.get_logger(__name__)
+
+# Every ONNX model the pipelines use, keyed by the env var holding its path
+ONNX_MODEL_ENV_VARS = [
+    "BITE_CHEW_MODEL_PATH",
+    "DISTRESS_MODEL_PATH",
+    "COW_DETECTION_MODEL_PATH",
+    "DISEASE_DETECTION_MODEL_PATH",
+]
+
+# Pickled (joblib) models and scalers, reloaded when the file changes
+ARTIFACT_ENV_VARS = [
+    "LAMNESS_SCALAR_MODEL_PATH",
+    "LAMNESS_MODEL_PATH",
+]
+
+# Name used in init_worker's preload list for the EasyOCR reader
+OCR_READER = "EASYOCR_READER"
+OCR_LANGUAGES = os.getenv("OCR_LANGUAGES", "en").split(",")
+# EasyOCR uses a GPU when one is available unless this is false
+OCR_GPU = os.getenv("OCR_GPU", "true").lower() == "true"
+
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", 3))
+
+# What each topic's pipeline loads, so a pool dedicated to one topic only
+# preloads (and holds in memory) its own models
+TOPIC_MODELS = {
+    "inference/microphone": ["BITE_CHEW_MODEL_PATH", "DISTRESS_MODEL_PATH"],
+    "inference/accelerometer": ["LAMNESS_SCALAR_MODEL_PATH", "LAMNESS_MODEL_PATH"],
+    "inference/camera": ["COW_DETECTION_MODEL_PATH", "DISEASE_DETECTION_MODEL_PATH", OCR_READER],
+}
+
+
+def preloaded_topics(env_vars=None):
+    """Topics whose models are all preloaded by init_worker(env_vars); None preloads every model."""
+    if env_vars is None:
+        return set(TOPIC_MODELS)
+    return {topic for topic, models in TOPIC_MODELS.items() if set(models) <= set(env_vars)}
+
+
+class ModelRegistry:
+    """
+    Process-resident cache of ONNX inference sessions and joblib artifacts.
+
+    Each pool process loads its models once (see init_worker, used as the
+    ProcessPoolExecutor initializer) and every pipeline call afterwards reuses
+    the same session instead of deserializing and optimizing the graph again.
+    """
+    _sessions = {}
+    _artifacts = {}  # {path: (mtime, artifact)}
+    _ocr_reader = None
+    _session_options = None
+    _pool_size = WORKER_POOL_SIZE
+
+    @classmethod
+    def session_options(cls):
+        """
+        Session options tuned for running inside a pool of `_pool_size` processes:
+        the CPU cores are split between the processes so they do not oversubscribe.
+        """
+        if cls._session_options is None:
+            import onnxruntime as ort
+            cpu_count = os.cpu_count() or 1
+            intra_threads = int(os.getenv("ORT_INTRA_OP_THREADS", max(1, cpu_count // max(1, cls._pool_size))))
+            inter_threads = int(os.getenv("ORT_INTER_OP_THREADS", 1))
+
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = intra_threads
+            options.inter_op_num_threads = inter_threads
+            options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            cls._session_options = options
+            logger.info(f"ONNX session options: intra_op_threads={intra_threads}, inter_op_threads={inter_threads}")
+        return cls._session_options
+
+    @classmethod
+    def load_session(cls, model_path):
+        """Return the cached session for `model_path`, loading it on first use."""
+        session = cls._sessions.get(model_path)
+        if session is None:
+            import onnxruntime as ort
+            if not model_path or not os.path.exists(model_path):
+                raise FileNotFoundError(f"ONNX model '{model_path}' does not exist.")
+            session = ort.InferenceSession(model_path, sess_options=cls.session_options(),
+                                           providers=["CPUExecutionProvider"])
+            cls._sessions[model_path] = session
+            logger.info(f"ONNX model loaded: {model_path}")
+        return session
+
+    @classmethod
+    def get_session(cls, env_var):
+        """Return the session for the model whose path is stored in `env_var`."""
+        return cls.load_session(os.getenv(env_var))
+
+    @classmethod
+    def load_artifact(cls, path):
+        """
+        Return the unpickled joblib artifact at `path`.
+
+        The artifact stays in memory until the file's mtime changes, at which
+        point it is reloaded, so a retrained model is picked up without a restart.
+        """
+        if not path or not os.path.exists(path):
+            raise FileNotFoundError(f"Artifact '{path}' does not exist.")
+        mtime = os.path.getmtime(path)
+        cached = cls._artifacts.get(path)
+        if cached is None or cached[0] != mtime:
+            import joblib
+            cls._artifacts[path] = (mtime, joblib.load(path))
+            logger.info(f"{'Reloaded' if cached else 'Loaded'} artifact: {path}")
+        return cls._artifacts[path][1]
+
+    @classmethod
+    def get_artifact(cls, env_var):
+        """Return the artifact whose path is stored in `env_var`."""
+        return cls.load_artifact(os.getenv(env_var))
+
+    @classmethod
+    def get_ocr_reader(cls):
+        """Return the process-wide EasyOCR reader, creating it on first use."""
+        if cls._ocr_reader is None:
+            import easyocr
+            cls._ocr_reader = easyocr.Reader(OCR_LANGUAGES, gpu=OCR_GPU, verbose=False)
+            logger.info(f"EasyOCR reader loaded for languages {OCR_LANGUAGES}")
+        return cls._ocr_reader
+
+    @classmethod
+    def init_worker(cls, env_vars=None, pool_size=None):
+        """
+        ProcessPoolExecutor initializer: preload the models once per process.
+
+        Args:
+            env_vars (list): Model path env vars (or OCR_READER) to preload. Defaults to all models.
+            pool_size (int): Number of processes in the pool, used to size the threads.
+        """
+        if pool_size:
+            cls._pool_size = pool_size
+        for env_var in env_vars if env_vars is not None else ONNX_MODEL_ENV_VARS + ARTIFACT_ENV_VARS + [OCR_READER]:
+            try:
+                if env_var == OCR_READER:
+                    cls.get_ocr_reader()
+                elif env_var in ARTIFACT_ENV_VARS:
+                    cls.get_artifact(env_var)
+                else:
+                    cls.get_session(env_var)
+            except Exception as e:
+                # Don't fail the pool; the pipeline retries the load on first use
+                logger.error(f"Could not preload model from {env_var}: {e}")
+
+
+def create_worker_pool(max_workers, env_vars=None, pool_size=None, max_tasks_per_child=None):
+    """
+    ProcessPoolExecutor whose processes preload `env_vars` through init_worker.
+
+    Args:
+        max_workers (int): Processes in this pool.
+        env_vars (list): Models to preload (see init_worker). Defaults to all models.
+        pool_size (int): Processes across all pools, used to split the CPU threads.
+        max_tasks_per_child (int): Replace a process after this many batches, to
+            bound leaks. Needs the spawn start method, so the replacement starts
+            clean and loads only its own models.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    kwargs = {}
+    if max_tasks_per_child:
+        import multiprocessing
+        kwargs = {"mp_context": multiprocessing.get_context("spawn"), "max_tasks_per_child": max_tasks_per_child}
+    return ProcessPoolExecutor(max_workers=max_workers,
+                               initializer=ModelRegistry.init_worker,
+                               initargs=(env_vars, pool_size or max_workers),
+                               **kwargs)
+
+
+def run_batched(session, inputs):
+    """
+    Run an (N, ...) batch through `session` and return its outputs.
+
+    Models exported with a dynamic batch dimension get the whole batch in one
+    session.run; models with a fixed batch size are run one row at a time and
+    their outputs concatenated, so callers can always pass a batch.
+    """
+    input_meta = session.get_inputs()[0]
+    batch_dim = input_meta.shape[0] if input_meta.shape else None
+    if not isinstance(batch_dim, int) or batch_dim == len(inputs):
+        return session.run(None, {input_meta.name: inputs})
+
+    import numpy as np
+    rows = [session.run(None, {input_meta.name: inputs[i:i + 1]}) for i in range(len(inputs))]
+    return [np.concatenate([np.asarray(row[k]) for row in rows]) for k in range(len(rows[0]))]
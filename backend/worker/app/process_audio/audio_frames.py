@@ -0,0 +1,80 @@
+import struct
+
+# Binary microphone frames (version 1), sent by sensors/microphone/main.py:
+#   version  uint8   AUDIO_FRAME_VERSION
+#   type     uint8   FRAME_START / FRAME_DATA / FRAME_END
+#   bovine   8s      ASCII bovine_id, NUL padded (at most 8 bytes)
+#   session  uint16  clip counter, wraps; ties chunks to their start frame
+#   index    uint16  chunk index (0 for start/end)
+#   total    uint16  number of data chunks in the clip
+# followed by the payload: the ISO timestamp for start/end frames, raw PCM for data.
+AUDIO_FRAME_HEADER = struct.Struct(">BB8sHHH")
+AUDIO_FRAME_VERSION = 1
+
+FRAME_START = 0
+FRAME_DATA = 1
+FRAME_END = 2
+FRAME_TYPES = {FRAME_START: "start", FRAME_DATA: "data", FRAME_END: "end"}
+
+
+def normalize_bovine_id(bovine_id):
+    """
+    The bovine_id as the worker keys it: decimal ids ("2" or 2) as int, like
+    the integer Bovine.id they reference, anything else as sent. Keeps the
+    batch, shard and DB keys the same whichever transport carried the id.
+    """
+    if isinstance(bovine_id, str) and bovine_id.isdecimal():
+        return int(bovine_id)
+    return bovine_id
+
+
+def is_audio_frame(payload):
+    """True if the payload is a binary frame rather than a JSON message."""
+    return len(payload) >= AUDIO_FRAME_HEADER.size and payload[0] == AUDIO_FRAME_VERSION
+
+
+def encode_audio_frame(frame_type, bovine_id, session, index, total, payload=b""):
+    """
+    Builds one binary frame (the firmware builds the same bytes in place).
+
+    Raises:
+        ValueError: If bovine_id is longer than the 8-byte header field.
+    """
+    bovine = str(bovine_id).encode()
+    if len(bovine) > 8:
+        raise ValueError(f"bovine_id {bovine_id!r} does not fit the 8-byte frame field")
+    header = AUDIO_FRAME_HEADER.pack(AUDIO_FRAME_VERSION, frame_type, bovine, session, index, total)
+    return header + bytes(payload)
+
+
+def parse_audio_frame(payload):
+    """
+    Decodes a binary frame into the same fields as the JSON microphone messages.
+
+    Args:
+        payload (bytes): The raw MQTT payload.
+
+    Returns:
+        dict: {"type", "bovine_id", "session", "index", "chunks"} plus "pcm"
+        (a memoryview over the payload, no copy) for data frames or
+        "timestamp" for start/end frames.
+    """
+    version, frame_type, bovine, session, index, total = AUDIO_FRAME_HEADER.unpack_from(payload)
+    if version != AUDIO_FRAME_VERSION:
+        raise ValueError(f"Unsupported audio frame version {version}")
+    if frame_type not in FRAME_TYPES:
+        raise ValueError(f"Unknown audio frame type {frame_type}")
+
+    message = {
+        "type": FRAME_TYPES[frame_type],
+        "bovine_id": normalize_bovine_id(bovine.rstrip(b"\0").decode()),
+        "session": session,
+        "index": index,
+        "chunks": total,
+    }
+    body = memoryview(payload)[AUDIO_FRAME_HEADER.size:]
+    if frame_type == FRAME_DATA:
+        message["pcm"] = body
+    else:
+        message["timestamp"] = bytes(body).decode()
+    return message
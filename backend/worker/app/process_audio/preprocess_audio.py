@@ -0,0 +1,188 @@
+import numpy as np
+import librosa
+from app.logging_service import MultiprocessLogger
+
+logger = MultiprocessLogger.get_logger(__name__)
+
+# WAV settings — must match ESP32 recording config
+DEVICE_SAMPLE_RATE = 22500
+# Rate the bite/chew and distress models were trained on (librosa.load default)
+MODEL_SAMPLE_RATE = 22050
+
+
+def decode_pcm(raw_bytes, orig_sr=DEVICE_SAMPLE_RATE, sr=MODEL_SAMPLE_RATE):
+    """Decodes raw 16-bit mono PCM into a float32 signal without touching the disk.
+
+    This gives the same signal librosa.load returns for the WAV file that
+    save_raw_to_wav would have written, so it can be fed straight to the
+    feature extractors.
+
+    Args:
+        raw_bytes: Joined PCM chunks (bytes, bytearray or memoryview).
+        orig_sr: Sample rate the device recorded at.
+        sr: Sample rate to resample to.
+
+    Returns:
+        A tuple (y, sr) with the float32 signal in [-1, 1) and its sample rate.
+    """
+    raw_bytes = memoryview(raw_bytes).cast("B")
+    # A trailing odd byte is an incomplete sample; the WAV reader drops it too
+    n_samples = len(raw_bytes) // 2
+    y = np.frombuffer(raw_bytes, dtype="<i2", count=n_samples).astype(np.float32)
+    y *= 1.0 / 32768.0
+    if orig_sr != sr:
+        y = librosa.resample(y, orig_sr=orig_sr, target_sr=sr)
+    logger.info(f"Decoded {n_samples} PCM samples at {orig_sr} Hz to {len(y)} samples at {sr} Hz")
+    return y, sr
+
+
+# Feature settings the models were trained with
+MFCC_N_FFT = 1024
+MFCC_HOP_LENGTH = 256
+MFCC_N_MELS = 128
+MFCC_N_COEFFS = 13
+MFCC_FRAMES = 128
+MEL_N_FFT = 2048
+MEL_HOP_LENGTH = 512
+MEL_N_MELS = 90
+
+_mel_bases = {}
+
+
+def _mel_basis(sr, n_fft, n_mels):
+    """Mel filterbank for (sr, n_fft, n_mels), built once per process."""
+    key = (sr, n_fft, n_mels)
+    if key not in _mel_bases:
+        _mel_bases[key] = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels).astype(np.float32)
+    return _mel_bases[key]
+
+
+def _power_spectrogram(y, n_fft, hop_length):
+    stft = librosa.stft(y, n_fft=n_fft, hop_length=hop_length)
+    return stft.real ** 2 + stft.imag ** 2
+
+
+class AudioFeatures:
+    """Features of one clip, shared by the bite/chew and distress models.
+
+    Attributes:
+        mfcc: (13, frames) MFCC matrix for the bite/chew XGB model.
+        log_mel: (90, frames) log-mel spectrogram for the distress model.
+    """
+
+    def __init__(self, mfcc, log_mel):
+        self.mfcc = mfcc
+        self.log_mel = log_mel
+
+    def mfcc_vector(self, frames=MFCC_FRAMES):
+        """MFCC padded/truncated to `frames` columns and flattened to (1, 13 * frames)."""
+        mfcc = self.mfcc
+        if mfcc.shape[1] < frames:
+            mfcc = np.pad(mfcc, ((0, 0), (0, frames - mfcc.shape[1])), mode='constant')
+        else:
+            mfcc = mfcc[:, :frames]
+        return np.ascontiguousarray(mfcc, dtype=np.float32).reshape(1, -1)
+
+
+def extract_audio_features(y, sr):
+    """Computes the MFCC and log-mel features of a clip in one pass.
+
+    Each power spectrogram is computed once and the mel filterbanks are cached,
+    so this matches librosa.feature.mfcc (n_fft=1024, hop 256) and
+    librosa.feature.melspectrogram + power_to_db (n_fft=2048, hop 512, 90 mels)
+    without recomputing anything per model.
+
+    Args:
+        y: float32 audio signal.
+        sr: Sample rate of `y`.
+
+    Returns:
+        An AudioFeatures instance.
+    """
+    from scipy.fftpack import dct
+
+    mfcc_power = _power_spectrogram(y, MFCC_N_FFT, MFCC_HOP_LENGTH)
+    mfcc_mel_db = librosa.power_to_db(_mel_basis(sr, MFCC_N_FFT, MFCC_N_MELS) @ mfcc_power)
+    mfcc = dct(mfcc_mel_db, axis=0, type=2, norm='ortho')[:MFCC_N_COEFFS].astype(np.float32)
+
+    mel_power = _power_spectrogram(y, MEL_N_FFT, MEL_HOP_LENGTH)
+    log_mel = librosa.power_to_db(_mel_basis(sr, MEL_N_FFT, MEL_N_MELS) @ mel_power)
+
+    return AudioFeatures(mfcc, log_mel)
+
+
+# Size of the distress model input image as (width, height)
+MELSPEC_IMAGE_SIZE = (90, 200)
+
+_resize_weights = {}
+
+
+def _lanczos(x):
+    return np.where(np.abs(x) < 3.0, np.sinc(x) * np.sinc(x / 3.0), 0.0)
+
+
+def _lanczos_weights(in_size, out_size):
+    """Resampling matrix (out_size, in_size) with the coefficients PIL's LANCZOS filter uses.
+
+    Like PIL, the kernel is stretched when downsampling so it antialiases, and
+    each row is normalized to sum to 1.
+    """
+    key = (in_size, out_size)
+    if key not in _resize_weights:
+        scale = in_size / out_size
+        filterscale = max(scale, 1.0)
+        support = 3.0 * filterscale
+        centers = (np.arange(out_size) + 0.5) * scale
+        # Same rounding of the kernel bounds as PIL's precompute_coeffs
+        xmin = np.maximum((centers - support + 0.5).astype(int), 0)
+        xmax = np.minimum((centers + support + 0.5).astype(int), in_size)
+        x = np.arange(in_size)
+        weights = _lanczos((x[None, :] - centers[:, None] + 0.5) / filterscale)
+        weights[(x[None, :] < xmin[:, None]) | (x[None, :] >= xmax[:, None])] = 0.0
+        totals = weights.sum(axis=1, keepdims=True)
+        np.divide(weights, totals, out=weights, where=totals != 0)
+        _resize_weights[key] = weights.astype(np.float32)
+    return _resize_weights[key]
+
+
+def scale_melspec(mel_spec, target_size=MELSPEC_IMAGE_SIZE):
+    """Normalizes log-mel spectrograms and resizes them to the distress model input.
+
+    A float32 version of the original PIL pipeline (per-frame normalize, scale
+    to 0-255, Lanczos resize to `target_size`): the resize is two matrix
+    products, so a whole batch is resized at once with no uint8 quantization
+    or Image allocation.
+
+    Args:
+        mel_spec: (n_mels, frames) spectrogram or an (N, n_mels, frames) batch.
+        target_size: Output size as (width, height), as PIL takes it.
+
+    Returns:
+        float32 array of shape (height, width), or (N, height, width) for a batch.
+    """
+    specs = np.asarray(mel_spec, dtype=np.float32)
+    # librosa.util.normalize: divide every frame by its max magnitude
+    peak = np.abs(specs).max(axis=-2, keepdims=True)
+    peak[peak < np.finfo(np.float32).tiny] = 1.0
+    levels = specs / peak * 255.0
+    # Negative levels wrap around like the uint8 cast the model was fed with
+    levels = np.where(levels <= -1.0, levels + 256.0, np.maximum(levels, 0.0))
+
+    width, height = target_size
+    # PIL resizes horizontally first, then vertically, clipping after each pass
+    image = levels @ _lanczos_weights(levels.shape[-1], width).T
+    np.clip(image, 0.0, 255.0, out=image)
+    image = _lanczos_weights(levels.shape[-2], height) @ image
+    np.clip(image, 0.0, 255.0, out=image)
+    return image
+
+
+def melspec_input_tensor(scaled_mel_specs):
+    """(N, H, W) scaled spectrograms as the (N, H, W, 3) distress model input.
+
+    The three channels are a broadcast view of the same data, not a copy.
+    """
+    specs = np.asarray(scaled_mel_specs, dtype=np.float32)
+    if specs.ndim == 2:
+        specs = specs[np.newaxis]
+    return np.broadcast_to(specs[..., np.newaxis], specs.shape + (3,))
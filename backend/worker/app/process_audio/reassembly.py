@@ -0,0 +1,97 @@
+import os
+
+# PCM bytes per data chunk sent by the collar (CHUNK_SIZE in sensors/microphone/main.py)
+AUDIO_CHUNK_SIZE = int(os.getenv("AUDIO_CHUNK_SIZE", 1024))
+# Largest clip a start message may announce; a 5 s collar clip is about 220 chunks
+MAX_CLIP_CHUNKS = int(os.getenv("MAX_CLIP_CHUNKS", 1024))
+
+
+class AudioReassembler:
+    """
+    Reassembles one collar's clip from its data chunks.
+
+    `start` preallocates the whole clip, each chunk is copied straight to
+    index * chunk_size as it arrives (in any order), and a one-byte-per-chunk
+    map of received chunks catches duplicates and gaps, so `finish` needs no
+    sort and no join. Only the last chunk may be shorter than chunk_size.
+    """
+
+    def __init__(self, chunk_size=AUDIO_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.reset()
+
+    def reset(self):
+        self.buffer = None
+        self.received = None
+        self.chunks = 0
+        self.count = 0
+        self.length = 0
+        self.timestamp = None
+        self.session = None
+
+    @property
+    def is_started(self):
+        return self.buffer is not None
+
+    def start(self, chunks, timestamp, session=None):
+        """
+        Opens a clip of `chunks` data chunks, dropping any clip in progress.
+
+        Raises:
+            ValueError: If `chunks` is not an int in 1..MAX_CLIP_CHUNKS (nothing is allocated).
+        """
+        self.reset()
+        if not isinstance(chunks, int) or not 0 < chunks <= MAX_CLIP_CHUNKS:
+            raise ValueError(f"clip of {chunks!r} chunks outside 1..{MAX_CLIP_CHUNKS}")
+        self.buffer = bytearray(chunks * self.chunk_size)
+        self.received = bytearray(chunks)
+        self.chunks = chunks
+        self.timestamp = timestamp
+        self.session = session
+
+    def add(self, index, data):
+        """
+        Copies one chunk into its place in the clip.
+
+        Returns:
+            bool: False if the chunk was already received (it is ignored).
+
+        Raises:
+            ValueError: If the index is out of range or the chunk has the wrong size.
+        """
+        if not 0 <= index < self.chunks:
+            raise ValueError(f"chunk index {index} outside 0..{self.chunks - 1}")
+        if self.received[index]:
+            return False
+        size = len(data)
+        if size > self.chunk_size or (size < self.chunk_size and index != self.chunks - 1):
+            raise ValueError(f"chunk {index} has {size} bytes, expected {self.chunk_size}")
+
+        offset = index * self.chunk_size
+        self.buffer[offset:offset + size] = data
+        self.received[index] = 1
+        self.count += 1
+        if index == self.chunks - 1:
+            self.length = offset + size
+        return True
+
+    def missing(self):
+        """Indices of the chunks not received yet."""
+        return [index for index, received in enumerate(self.received or b"") if not received]
+
+    def finish(self):
+        """
+        Closes the clip and hands over its PCM.
+
+        The buffer itself is handed over (trimmed in place to the clip length)
+        rather than a memoryview, since the clip is pickled to the process pool.
+
+        Returns:
+            bytearray: The clip, or None if chunks are missing.
+        """
+        if not self.is_started or self.count != self.chunks:
+            return None
+        clip = self.buffer
+        del clip[self.length:]
+        self.reset()
+        return clip
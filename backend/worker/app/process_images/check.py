@@ -12,10 +12,10 @@ def check_onnx_model():
         logger.error(f"The file '{scaler_filename}' does not exist.")
     else:
         logger.info(f"The file '{scaler_filename}' exists.")
-        # Load the ONNX model
+        # Get the process-resident ONNX session (loaded once per worker)
         try:
-            import onnxruntime as ort
-            ort_session = ort.InferenceSession(scaler_filename, providers=["CPUExecutionProvider"])
+            from app.model_registry import ModelRegistry
+            ort_session = ModelRegistry.get_session("COW_DETECTION_MODEL_PATH")
             logger.info("ONNX model loaded")
             return ort_session
         except Exception as e:
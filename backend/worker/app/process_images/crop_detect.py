@@ -4,18 +4,28 @@ import onnxruntime as ort
 import numpy as np
 import cv2
 from PIL import Image
-import easyocr
 import os
 import joblib
 from dotenv import load_dotenv
 from app.logging_service import MultiprocessLogger
+from app.model_registry import ModelRegistry, run_batched
 
 load_dotenv()
 logger = MultiprocessLogger.get_logger(__name__)
 
-def detect_cows(image):
+# Letterbox camera frames (keep aspect ratio) instead of stretching them to 640x640
+YOLO_LETTERBOX = os.getenv("YOLO_LETTERBOX", "false").lower() == "true"
+
+def detect_cows(image, image_offset=0):
+    """
+    Detects cows in one camera frame and returns their crops.
+
+    Args:
+        image: Base64 image string (JSON camera topic) or raw image bytes (binary camera topic).
+        image_offset: Where the image starts in raw `image` bytes.
+    """
     try:
-        from process_images.preprocess_images import decode_base64_image, filter_Detections, rescale_back
+        from process_images.preprocess_images import decode_base64_image, decode_image_bytes, filter_Detections, rescale_back, prepare_yolo_input
     except Exception as e:
         logger.error(f"Import error: {e}")
         return []
@@ -39,7 +49,10 @@ def detect_cows(image):
         return []
 
     try:
-        image_data = decode_base64_image(image)
+        if isinstance(image, (bytes, bytearray)):
+            image_data = decode_image_bytes(image, image_offset)
+        else:
+            image_data = decode_base64_image(image)
         if image_data is None:
             logger.error("Decoded image is None")
             return []
@@ -51,16 +64,8 @@ def detect_cows(image):
     try:
         img_w, img_h = image_data.shape[1], image_data.shape[0]
         logger.info(f"Image width: {img_w}, Image height: {img_h}")
-        img = cv2.resize(image_data, (640, 640))
-        logger.info("image resized")
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        logger.info("image converted to RGB")
-        img = img.transpose(2, 0, 1)
-        logger.info("image transposed")
-        img = img.reshape(1, 3, 640, 640)
-        logger.info("image reshaped")
-        img = img / 255.0
-        img = img.astype(np.float32)
+        # decode_base64_image already returns RGB; resize and scale straight into the input buffer
+        img, transforms = prepare_yolo_input([image_data], letterbox=YOLO_LETTERBOX)
         logger.info("image preprocessed")
     except Exception as e:
         logger.error(f"Error preprocessing image: {e}")
@@ -78,7 +83,7 @@ def detect_cows(image):
         results = results.transpose()
         results = filter_Detections(results)
         logger.info("detections filtered")
-        rescaled_results, confidences = rescale_back(results, img_w, img_h)
+        rescaled_results, confidences = rescale_back(results, img_w, img_h, transforms[0])
         logger.info(f"Confidence scores: {confidences}")
         logger.info("cows detected")
     except Exception as e:
@@ -109,16 +114,7 @@ def detect_cows(image):
     return cropped_images
 
 
-def read_tag(cow_crop):
-    try:
-        logger.info("Reading tag number...")
-        reader = easyocr.Reader(['en'])
-        cow_crop_np = np.array(cow_crop)
-        result = reader.readtext(cow_crop_np)
-    except Exception as e:
-        logger.error(f"Error reading tag: {e}")
-        return None
-
+def _best_tag(result):
     best_tag = None
     max_confidence = 0.0
     try:
@@ -139,16 +135,98 @@ def read_tag(cow_crop):
     return best_tag
 
 
-def preprocess_image(image):
+def read_tag(cow_crop):
+    return read_tags([cow_crop])[0]
+
+
+def read_tags(cow_crops):
+    """Reads the tag number on each crop with the process-wide OCR reader.
+
+    Several crops are zero-padded (bottom/right, so text positions are kept)
+    to a common size and read in one batched call.
+
+    Returns:
+        A list with the best tag (or None) for each crop.
+    """
+    if not cow_crops:
+        return []
     try:
-        image = image.resize((224, 224))
-        image = np.array(image).astype(np.float32) / 255.0
-        image = (image - 0.5) / 0.5
-        image = image.transpose(2, 0, 1)
-        return np.expand_dims(image, axis=0)
+        logger.info(f"Reading tag numbers on {len(cow_crops)} crops...")
+        reader = ModelRegistry.get_ocr_reader()
+        crops = [np.asarray(cow_crop) for cow_crop in cow_crops]
+        if len(crops) == 1:
+            results = [reader.readtext(crops[0])]
+        else:
+            height = max(crop.shape[0] for crop in crops)
+            width = max(crop.shape[1] for crop in crops)
+            batch = np.zeros((len(crops), height, width) + crops[0].shape[2:], dtype=crops[0].dtype)
+            for i, crop in enumerate(crops):
+                batch[i, :crop.shape[0], :crop.shape[1]] = crop
+            results = reader.readtext_batched(list(batch))
     except Exception as e:
-        logger.error(f"Error preprocessing image: {e}")
-        return None
+        logger.error(f"Error reading tag: {e}")
+        return [None] * len(cow_crops)
+
+    return [_best_tag(result) for result in results]
+
+
+DISEASE_INPUT_SIZE = 224
+DISEASE_CLASS_NAMES = ["BRD", "Bovine", "Contagious", "Disease", "Ecthym", "Respiratory","Unlabelled", "Healthy", "Lumpy","Skin"]
+# Classes that are not reported as a disease
+NON_DISEASE_CLASSES = ["Healthy", "Skin", ""]
+
+
+def preprocess_image(image):
+    batch, _ = preprocess_images([image])
+    return batch if len(batch) else None
+
+
+def preprocess_images(images):
+    """Resizes the crops into one (N, 3, 224, 224) float32 tensor normalized to [-1, 1].
+
+    Returns:
+        A tuple (batch, kept) where `kept` lists the indices of the crops in
+        `batch`; crops that fail to preprocess are skipped.
+    """
+    size = DISEASE_INPUT_SIZE
+    pixels = np.empty((len(images), size, size, 3), dtype=np.uint8)
+    kept = []
+    for idx, image in enumerate(images):
+        try:
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            pixels[len(kept)] = np.asarray(image.resize((size, size)))
+            kept.append(idx)
+        except Exception as e:
+            logger.error(f"Error preprocessing image: {e}")
+
+    # (x / 255 - 0.5) / 0.5 in one pass, written straight into the NCHW tensor
+    batch = np.empty((len(kept), 3, size, size), dtype=np.float32)
+    np.multiply(pixels[:len(kept)].transpose(0, 3, 1, 2), np.float32(2.0 / 255.0), out=batch)
+    batch -= 1.0
+    return batch, kept
+
+
+def classify_diseases(cow_crops):
+    """Runs the disease model once over all crops.
+
+    Returns:
+        A list with the diseased labels of each crop (None for crops that
+        could not be preprocessed).
+    """
+    labels = [None] * len(cow_crops)
+    batch, kept = preprocess_images(cow_crops)
+    if not kept:
+        return labels
+
+    session = ModelRegistry.get_session("DISEASE_DETECTION_MODEL_PATH")
+    logits = run_batched(session, batch)[0]
+    # sigmoid(logits) > 0.5, restricted to the classes that count as a disease
+    reportable = np.array([name not in NON_DISEASE_CLASSES for name in DISEASE_CLASS_NAMES])
+    pred = (logits > 0) & reportable
+    for row, idx in enumerate(kept):
+        labels[idx] = [DISEASE_CLASS_NAMES[i] for i in np.flatnonzero(pred[row])]
+    return labels
 
 
 def batch_detect_diseases(cow_crops):
@@ -159,29 +237,24 @@ def batch_detect_diseases(cow_crops):
             return []
 
         results = []
-        for idx, cow_crop in enumerate(cow_crops):
-            input_image = preprocess_image(cow_crop)
-            if input_image is None:
+        for idx, (cow_crop, diseased_labels) in enumerate(zip(cow_crops, classify_diseases(cow_crops))):
+            if diseased_labels is None:
                 logger.warning(f"Skipping cow crop {idx + 1} due to preprocessing error")
                 continue
-            disease_model = os.getenv("DISEASE_DETECTION_MODEL_PATH")
-            session = ort.InferenceSession(disease_model, providers=["CPUExecutionProvider"])
-            outputs = session.run(None, {"input": input_image})
-            logits = outputs[0]
-            probs = 1 / (1 + np.exp(-logits))
-            pred = (probs > 0.5).astype(int)
-            class_names = ["BRD", "Bovine", "Contagious", "Disease", "Ecthym", "Respiratory","Unlabelled", "Healthy", "Lumpy","Skin"]
-            diseased_labels = [class_names[i] for i in range(len(class_names)) if pred[0][i] == 1 and class_names[i] not in ["Healthy", "Skin", ""]]
             logger.info(f"Predicted labels for cow {idx + 1}: {diseased_labels}")
             if diseased_labels:
-                cow_tag = read_tag(cow_crop)
                 results.append({
-                    "Bovine_tag": cow_tag,
                     "disease_status": diseased_labels,
-                    "image": cow_crop
+                    "image": cow_crop,
+                    "crop_index": idx
                 })
                 logger.info(f"Detected diseases for cow {idx + 1}: {diseased_labels}")
+
+        # Read the tags of all diseased cows in one OCR call
+        cow_tags = read_tags([result["image"] for result in results])
+        for result, cow_tag in zip(results, cow_tags):
+            result["Bovine_tag"] = cow_tag
         return results
     except Exception as e:
         logger.error(f"Error in batch_detect_diseases: {e}")
-        return []
\ No newline at end of file
+        return []
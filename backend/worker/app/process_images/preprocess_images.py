@@ -1,10 +1,65 @@
 import numpy as np
 import cv2
 import base64
+import json
+import os
+import struct
 from app.logging_service import MultiprocessLogger
 
 logger = MultiprocessLogger.get_logger(__name__)
 
+# Use OpenCV's NMSBoxes instead of the NumPy NMS
+USE_CV2_NMS = os.getenv("USE_CV2_NMS", "false").lower() == "true"
+
+# Binary camera frames: a big-endian uint16 header length, a UTF-8 JSON
+# header with the metadata (bovine_id, timestamp, ...), then the JPEG bytes
+CAMERA_FRAME_HEADER = struct.Struct(">H")
+
+def parse_camera_frame(payload):
+    """Splits a binary camera frame into its metadata and the offset of the image bytes.
+
+    Args:
+        payload: The raw MQTT payload.
+
+    Returns:
+        A tuple (metadata, image_offset); the image is payload[image_offset:].
+    """
+    (header_length,) = CAMERA_FRAME_HEADER.unpack_from(payload)
+    image_offset = CAMERA_FRAME_HEADER.size + header_length
+    if image_offset > len(payload):
+        raise ValueError(f"Camera frame header length {header_length} exceeds payload size {len(payload)}")
+    metadata = json.loads(bytes(payload[CAMERA_FRAME_HEADER.size:image_offset]))
+    if not isinstance(metadata, dict):
+        raise ValueError("Camera frame header is not a JSON object")
+    return metadata, image_offset
+
+def encode_camera_frame(metadata, image_bytes):
+    """Builds a binary camera frame (the inverse of parse_camera_frame)."""
+    header = json.dumps(metadata).encode()
+    return CAMERA_FRAME_HEADER.pack(len(header)) + header + bytes(image_bytes)
+
+def decode_image_bytes(image_bytes, offset=0):
+    """Decodes encoded (JPEG/PNG) image bytes into an RGB NumPy array without copying the bytes.
+
+    Args:
+        image_bytes: Buffer holding the encoded image.
+        offset: Where the image starts in the buffer.
+
+    Returns:
+        A NumPy array representing the image, or None if it cannot be decoded.
+    """
+    try:
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8, offset=offset), cv2.IMREAD_COLOR)
+        if image is None:
+            logger.error("Image bytes could not be decoded")
+            return None
+
+        # Convert color format from BGR (OpenCV) to RGB (PIL)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    except Exception as e:
+        logger.error(f"Error decoding image bytes: {e}")
+        return None
+
 def decode_base64_image(base64_string):
     """Decodes a base64 encoded image string into a NumPy array.
 
@@ -22,112 +77,145 @@ def decode_base64_image(base64_string):
         # Decode the base64 string
         decoded_bytes = base64.b64decode(base64_string)
 
-        # Read the image using OpenCV
-        image = cv2.imdecode(np.frombuffer(decoded_bytes, np.uint8), cv2.IMREAD_COLOR)
-
-        # Convert color format from BGR (OpenCV) to RGB (PIL)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)  # Add this line
-
-        return image
+        return decode_image_bytes(decoded_bytes)
     except Exception as e:
         logger.error(f"Error decoding base64 image: {e}")
         return None
     
-def filter_Detections(results, thresh = 0.5):
-    # if model is trained on 1 class only
-    if len(results[0]) == 5:
-        # filter out the detections with confidence > thresh
-        considerable_detections = [detection for detection in results if detection[4] > thresh]
-        considerable_detections = np.array(considerable_detections)
-        return considerable_detections
-
-    # if model is trained on multiple classes
-    else:
-        A = []
-        for detection in results:
+YOLO_INPUT_SIZE = 640
+# Pad color used by Ultralytics letterboxing
+LETTERBOX_COLOR = (114, 114, 114)
 
-            class_id = detection[4:].argmax()
-            confidence_score = detection[4:].max()
+_input_buffers = {}
 
-            new_detection = np.append(detection[:4],[class_id,confidence_score])
 
-            A.append(new_detection)
+def prepare_yolo_input(images, size=YOLO_INPUT_SIZE, letterbox=False):
+    """Writes RGB frames straight into a reusable (N, 3, size, size) float32 buffer scaled to [0, 1].
 
-        A = np.array(A)
+    The buffer is cached per batch shape and overwritten by the next call, so
+    it must be consumed (session.run) before preparing the next batch.
 
-        # filter out the detections with confidence > thresh
-        considerable_detections = [detection for detection in A if detection[-1] > thresh]
-        considerable_detections = np.array(considerable_detections)
-
-        return considerable_detections    
-    
-def NMS(boxes, conf_scores, iou_thresh = 0.55):
-
-    #  boxes [[x1,y1, x2,y2], [x1,y1, x2,y2], ...]
-
-    x1 = boxes[:,0]
-    y1 = boxes[:,1]
-    x2 = boxes[:,2]
-    y2 = boxes[:,3]
+    Args:
+        images: List of RGB uint8 frames (as returned by decode_base64_image).
+        size: Model input size.
+        letterbox: Keep the aspect ratio by padding instead of stretching.
 
-    areas = (x2-x1)*(y2-y1)
+    Returns:
+        A tuple (buffer, transforms): one (scale_x, scale_y, pad_x, pad_y)
+        per frame, mapping model coordinates back with (x - pad) / scale.
+    """
+    key = (len(images), size)
+    if key not in _input_buffers:
+        _input_buffers[key] = (np.empty((len(images), 3, size, size), dtype=np.float32),
+                               np.empty((size, size, 3), dtype=np.uint8))
+    buffer, canvas = _input_buffers[key]
+
+    transforms = []
+    for i, image in enumerate(images):
+        img_h, img_w = image.shape[:2]
+        if letterbox:
+            scale = min(size / img_w, size / img_h)
+            new_w, new_h = round(img_w * scale), round(img_h * scale)
+            pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+            canvas[:] = LETTERBOX_COLOR
+            cv2.resize(image, (new_w, new_h), dst=canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w])
+            transforms.append((new_w / img_w, new_h / img_h, pad_x, pad_y))
+        else:
+            cv2.resize(image, (size, size), dst=canvas)
+            transforms.append((size / img_w, size / img_h, 0, 0))
+        # HWC uint8 -> CHW float32 in one pass, no float64 temporaries
+        np.multiply(canvas.transpose(2, 0, 1), np.float32(1.0 / 255.0), out=buffer[i])
+    return buffer, transforms
 
-    order = conf_scores.argsort()
 
-    keep = []
-    keep_confidences = []
+def filter_Detections(results, thresh = 0.5):
+    """Decodes raw YOLO rows into [cx, cy, w, h, class_id, confidence] detections above `thresh`.
 
-    while len(order) > 0:
-        idx = order[-1]
-        A = boxes[idx]
-        conf = conf_scores[idx]
+    Args:
+        results: (num_candidates, 4 + num_classes) model output rows; a
+            trailing singleton axis (from transposing (1, C, N)) is allowed.
+        thresh: Minimum class confidence to keep a detection.
+    """
+    results = np.asarray(results)
+    results = results.reshape(results.shape[0], -1)
 
-        order = order[:-1]
+    # if model is trained on 1 class only
+    if results.shape[1] == 5:
+        # filter out the detections with confidence > thresh
+        return results[results[:, 4] > thresh]
 
-        xx1 = np.take(x1, indices= order)
-        yy1 = np.take(y1, indices= order)
-        xx2 = np.take(x2, indices= order)
-        yy2 = np.take(y2, indices= order)
+    # if model is trained on multiple classes: best class per row, in one pass
+    class_scores = results[:, 4:]
+    class_ids = class_scores.argmax(axis=1)
+    confidence_scores = np.take_along_axis(class_scores, class_ids[:, np.newaxis], axis=1)[:, 0]
 
-        keep.append(A)
-        keep_confidences.append(conf)
+    # filter out the detections with confidence > thresh
+    mask = confidence_scores > thresh
+    return np.column_stack((results[mask, :4], class_ids[mask], confidence_scores[mask]))
+    
+def NMS(boxes, conf_scores, iou_thresh = 0.55, class_aware = True):
+    """Greedy non-maximum suppression, highest confidence first.
 
-        # iou = inter/union
+    Args:
+        boxes: (N, 4) [x1, y1, x2, y2] boxes, optionally with a class_id 5th column.
+        conf_scores: (N,) confidences.
+        iou_thresh: Boxes overlapping a kept box by at least this IoU are dropped.
+        class_aware: Only suppress boxes of the same class (needs the class_id column).
 
-        xx1 = np.maximum(x1[idx], xx1)
-        yy1 = np.maximum(y1[idx], yy1)
-        xx2 = np.minimum(x2[idx], xx2)
-        yy2 = np.minimum(y2[idx], yy2)
+    Returns:
+        The kept boxes and their confidences, as lists in descending confidence.
+    """
+    boxes = np.asarray(boxes)
+    conf_scores = np.asarray(conf_scores)
+    if len(boxes) == 0:
+        return [], []
+
+    coords = boxes[:, :4].astype(np.float64)
+    if class_aware and boxes.shape[1] > 4:
+        # Shift each class to its own region so boxes of different classes never overlap
+        offset = np.abs(coords).max() * 2 + 1
+        coords = coords + boxes[:, 4:5].astype(np.float64) * offset
+
+    if USE_CV2_NMS:
+        xywh = np.column_stack((coords[:, :2], coords[:, 2:] - coords[:, :2]))
+        keep = np.array(cv2.dnn.NMSBoxes(xywh.tolist(), conf_scores.astype(float).tolist(),
+                                         0.0, iou_thresh), dtype=int).reshape(-1)
+        return list(boxes[keep]), list(conf_scores[keep])
+
+    order = conf_scores.argsort()[::-1]
+    x1, y1, x2, y2 = coords[order].T
+    areas = (x2-x1)*(y2-y1)
 
-        w = np.maximum(xx2-xx1, 0)
-        h = np.maximum(yy2-yy1, 0)
+    # Each pass keeps the best remaining box and drops everything it overlaps,
+    # so the loop runs once per kept box rather than once per candidate
+    remaining = np.arange(len(order))
+    keep = []
+    while len(remaining) > 0:
+        i, rest = remaining[0], remaining[1:]
+        keep.append(i)
 
+        # iou = inter/union against all remaining boxes at once
+        w = np.maximum(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0)
+        h = np.maximum(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0)
         intersection = w*h
+        union = areas[i] + areas[rest] - intersection
+        remaining = rest[intersection < iou_thresh * union]
 
-        # union = areaA + other_areas - intesection
-        other_areas = np.take(areas, indices= order)
-        union = areas[idx] + other_areas - intersection
-
-        iou = intersection/union
-
-        boleans = iou < iou_thresh
-
-        order = order[boleans]
-
-        # order = [2,0,1]  boleans = [True, False, True]
-        # order = [2,1]
-
-    return keep, keep_confidences
+    keep = order[keep]
+    return list(boxes[keep]), list(conf_scores[keep])
 
 
 
 # function to rescale bounding boxes 
-def rescale_back(results,img_w,img_h):
+def rescale_back(results,img_w,img_h,transform=None):
     cx, cy, w, h, class_id, confidence = results[:,0], results[:,1], results[:,2], results[:,3], results[:,4], results[:,-1]
-    cx = cx/640.0 * img_w
-    cy = cy/640.0 * img_h
-    w = w/640.0 * img_w
-    h = h/640.0 * img_h
+    if transform is None:
+        transform = (640.0 / img_w, 640.0 / img_h, 0, 0)
+    scale_x, scale_y, pad_x, pad_y = transform
+    cx = (cx - pad_x) / scale_x
+    cy = (cy - pad_y) / scale_y
+    w = w / scale_x
+    h = h / scale_y
     x1 = cx - w/2
     y1 = cy - h/2
     x2 = cx + w/2
@@ -10,11 +10,15 @@ import joblib
 import os
 from dotenv import load_dotenv
 from app.logging_service import MultiprocessLogger
+from app.model_registry import ModelRegistry
 
 load_dotenv()
 
 logger = MultiprocessLogger.get_logger(__name__)
 
+# Rows passed to a single model.predict call; bounds memory on long windows
+LAMENESS_PREDICT_CHUNK_SIZE = int(os.getenv("LAMENESS_PREDICT_CHUNK_SIZE", 5000))
+
 hello = {
   "acclerometer_data": [
     {
@@ -77,42 +81,95 @@ hello = {
   ]
 }
 
-def ExtractFeaturesFromJSON(json_input):
+FEATURES = ['Acceleration_x', 'Acceleration_y', 'Acceleration_z',
+            'Gravity_x', 'Gravity_y', 'Gravity_z',
+            'Rotation_x', 'Rotation_y', 'Rotation_z',
+            'Roll', 'Pitch', 'Yaw']
+ROLLING_WINDOW = 5
+# Column order the lameness model was trained with
+FEATURE_COLUMNS = (FEATURES
+                   + [f'Cumsum_{feature}' for feature in FEATURES]
+                   + [f'Rolling_{stat}_{feature}' for feature in FEATURES for stat in ('Mean', 'Std')])
+
+
+def accelerometer_array(json_input):
+    """Packs the readings into one contiguous (N, 12) float32 array in FEATURES order.
+
+    Rows with a missing or null value are dropped. Lameness features and step
+    counting both work off this array.
+
+    Returns:
+        The array, or None if the input has no 'acclerometer_data' or lacks a feature.
+    """
+    if 'acclerometer_data' not in json_input:
+        logger.error("Key 'acclerometer_data' not found in input JSON.")
+        return None
+
+    accelerometer_data = json_input['acclerometer_data']
+    present = set().union(*accelerometer_data) if accelerometer_data else set()
+    if not all(feature in present for feature in FEATURES):
+        logger.error("Missing required features in input data.")
+        return None
+
+    raw = np.array([[row.get(feature) for feature in FEATURES] for row in accelerometer_data],
+                   dtype=np.float32).reshape(-1, len(FEATURES))
+    return np.ascontiguousarray(raw[~np.isnan(raw).any(axis=1)])
+
+
+def _model_input(model, array, columns):
+    # Models fitted on a DataFrame warn when given a bare array; wrap it without copying
+    if hasattr(model, 'feature_names_in_'):
+        return pd.DataFrame(array, columns=columns, copy=False)
+    return array
+
+
+def lameness_features(scaled):
+    """Builds the 48 lameness features from scaled (N, 12) readings.
+
+    Per row: the scaled readings, their running sums, and the mean and sample
+    standard deviation over the last ROLLING_WINDOW rows, in FEATURE_COLUMNS
+    order. The first ROLLING_WINDOW - 1 rows have no full window and are
+    dropped, as the pandas rolling/dropna version did.
+
+    Args:
+        scaled: (N, 12) scaled readings.
+
+    Returns:
+        float32 array of shape (N - ROLLING_WINDOW + 1, 48).
+    """
+    n_rows = len(scaled) - ROLLING_WINDOW + 1
+    n_features = len(FEATURES)
+    out = np.empty((max(n_rows, 0), len(FEATURE_COLUMNS)), dtype=np.float32)
+    if n_rows <= 0:
+        return out
+
+    cumsum = np.cumsum(scaled, axis=0, dtype=np.float64)
+    windows = np.lib.stride_tricks.sliding_window_view(scaled, ROLLING_WINDOW, axis=0)
+
+    out[:, :n_features] = scaled[ROLLING_WINDOW - 1:]
+    out[:, n_features:2 * n_features] = cumsum[ROLLING_WINDOW - 1:]
+    out[:, 2 * n_features::2] = windows.mean(axis=-1, dtype=np.float64)
+    out[:, 2 * n_features + 1::2] = windows.std(axis=-1, ddof=1, dtype=np.float64)
+    return out
+
+
+def ExtractFeaturesFromJSON(json_input, raw=None):
+    """Scales the readings and builds the lameness feature matrix.
+
+    Args:
+        json_input: Dict with an 'acclerometer_data' list of readings.
+        raw: The (N, 12) array from accelerometer_array, if already built.
+
+    Returns:
+        float32 array with one FEATURE_COLUMNS row per complete window, or None on error.
+    """
     logger.info("ExtractFeaturesFromJSON called")
     try:
-        # Convert JSON string to Python dict if needed
-        # json_input =   hello 
-        # if isinstance(json_input, str):
-        #     json_input = json_input.replace("'", '"')
-        #     logger.info(json_input)
-        #     data_dict = json.loads(json_input)
-        # elif isinstance(json_input, dict):
-        #     data_dict = json_input
-        # else:
-        #     logger.error("Invalid input format. Must be JSON string or dictionary.")
-        #     return None
-
-        # Check if the key 'acclerometer_data' exists
-        if 'acclerometer_data' not in json_input:
-            logger.error("Key 'acclerometer_data' not found in input JSON.")
-            return None
-
-        # Extract accelerometer data from the JSON
-        accelerometer_data = json_input['acclerometer_data']
+        if raw is None:
+            raw = accelerometer_array(json_input)
+            if raw is None:
+                return None
         logger.info("Accelerometer data extracted successfully.")
-        # Convert   accelerometer data to a DataFrame
-        df = pd.DataFrame(accelerometer_data)
-        df = df.dropna()
-        # logger.info("columns in df", df.columns)
-        features = ['Acceleration_x', 'Acceleration_y', 'Acceleration_z',
-                    'Gravity_x', 'Gravity_y', 'Gravity_z',
-                    'Rotation_x', 'Rotation_y', 'Rotation_z',
-                    'Roll', 'Pitch', 'Yaw']
-
-        # Check if all required features are in the data
-        if not all(feature in df.columns for feature in features):
-            logger.error("Missing required features in input data.")
-            return None
 
         # Load the scaler
         logger.info("Loading scaler...")
@@ -121,49 +178,41 @@ def ExtractFeaturesFromJSON(json_input):
             logger.error(f"Scaler file '{scaler_filename}' does not exist.")
             return None
 
-        scaler = joblib.load(scaler_filename)
+        scaler = ModelRegistry.load_artifact(scaler_filename)
         logger.info("Scaler loaded successfully.")
 
         # Scale the data
-        scaled_data = scaler.transform(df[features])
-        df_scaled = pd.DataFrame(scaled_data, columns=features, index=df.index)
+        scaled = np.asarray(scaler.transform(_model_input(scaler, raw, FEATURES)), dtype=np.float32)
         logger.info("Data scaled successfully.")
-        # Add cumulative sum features
-        for feature in features:
-            df_scaled[f'Cumsum_{feature}'] = df_scaled[feature].cumsum()
-        logger.info("Cumulative sum features added successfully.")
-        # Add rolling features
-        window_size = 5
-        for feature in features:
-            df_scaled[f'Rolling_Mean_{feature}'] = df_scaled[feature].rolling(window=window_size).mean()
-            df_scaled[f'Rolling_Std_{feature}'] = df_scaled[feature].rolling(window=window_size).std()
-        logger.info("Rolling features added successfully.")
-        # Drop rows with any NaN values resulting from rolling operations
-        return df_scaled.dropna()
+
+        features = lameness_features(scaled)
+        logger.info("Cumulative sum and rolling features added successfully.")
+        return features
 
     except Exception as e:
         logger.error(f"Error in ExtractFeaturesFromJSON: {e}")
         return None
 
 
-def count_steps_from_accelerometer(data):
+def count_steps_from_accelerometer(data, raw=None):
     """Count steps from accelerometer data with error handling and logging."""
     try:
         import scipy.signal as signal
-        if 'acclerometer_data' not in data:
-            logger.error("No 'acclerometer_data' found for step counting.")
-            return None
-        df = pd.DataFrame(data['acclerometer_data'])
-        required_cols = ['Acceleration_x', 'Acceleration_y', 'Acceleration_z']
-        if not all(col in df.columns for col in required_cols):
-            logger.error("Missing acceleration columns for step counting.")
-            return None
-        df['acc_magnitude'] = np.sqrt(df['Acceleration_x']**2 + df['Acceleration_y']**2 + df['Acceleration_z']**2)
-        if len(df['acc_magnitude']) < 5:
+        if raw is None:
+            if 'acclerometer_data' not in data:
+                logger.error("No 'acclerometer_data' found for step counting.")
+                return None
+            raw = accelerometer_array(data)
+            if raw is None:
+                logger.error("Missing acceleration columns for step counting.")
+                return None
+        # Acceleration_x/y/z are the first three columns
+        acc_magnitude = np.sqrt(np.einsum('ij,ij->i', raw[:, :3], raw[:, :3], dtype=np.float64))
+        if len(acc_magnitude) < 5:
             logger.error("Not enough data points for smoothing and peak detection.")
             return None
-        df['acc_magnitude_smooth'] = signal.savgol_filter(df['acc_magnitude'], window_length=5, polyorder=2)
-        peaks, _ = signal.find_peaks(df['acc_magnitude_smooth'], height=0.01, distance=10)
+        acc_magnitude_smooth = signal.savgol_filter(acc_magnitude, window_length=5, polyorder=2)
+        peaks, _ = signal.find_peaks(acc_magnitude_smooth, height=0.01, distance=10)
         number_of_steps = len(peaks)
         # number_of_steps =  10
         logger.info(f"Estimated Number of Steps: {number_of_steps}")
@@ -173,43 +222,72 @@ def count_steps_from_accelerometer(data):
         return None
 
 
+def predict_from_features(FEdata):
+    """Runs the lameness model over a feature matrix and returns the ceil of the mean prediction."""
+    predictions = []
+
+    model_path = os.getenv("LAMNESS_MODEL_PATH")
+    if not os.path.exists(model_path):
+        logger.error(f"Model file '{model_path}' does not exist.")
+        return None
+
+    loaded_model = ModelRegistry.load_artifact(model_path)
+    logger.info("Model loaded successfully.")
+
+    try:
+        # Predict whole chunks of the frame at once instead of row by row
+        for start in range(0, len(FEdata), LAMENESS_PREDICT_CHUNK_SIZE):
+            chunk = FEdata[start:start + LAMENESS_PREDICT_CHUNK_SIZE]
+            pred = loaded_model.predict(_model_input(loaded_model, chunk, FEATURE_COLUMNS))
+            predictions.append(pred)
+        predictions = np.concatenate(predictions) if predictions else np.array([])
+    except Exception as e:
+        logger.error(f"Error during model prediction: {e}")
+        return None
+
+    mean_prediction = np.mean(predictions)
+    logger.info(f"Mean prediction: {mean_prediction}")
+    prediction = math.ceil(mean_prediction)
+    logger.info(f"Final prediction (rounded): {prediction}")
+    return prediction
+
+
 def predict_lameness(data):
     logger.info("predict_lameness called")
     try:
         logger.info("transforming data")
-        FEdata = ExtractFeaturesFromJSON(data)
-        if FEdata is None:
+        # One array of readings shared by feature extraction and step counting
+        raw = accelerometer_array(data)
+        if raw is None:
             logger.error("Feature extraction failed.")
             return None
-        
-        # logger.info("after FEdata", FEdata.head())
-        predictions = []
-
-        model_path = os.getenv("LAMNESS_MODEL_PATH")
-        if not os.path.exists(model_path):
-            logger.error(f"Model file '{model_path}' does not exist.")
+        FEdata = ExtractFeaturesFromJSON(data, raw=raw)
+        if FEdata is None:
+            logger.error("Feature extraction failed.")
             return None
 
-        loaded_model = joblib.load(model_path)
-        logger.info("Model loaded successfully.")
-
-        try:
-            for i in range(len(FEdata)):
-                pred = loaded_model.predict(FEdata.iloc[[i]])
-                predictions.append(pred[0])
-        except Exception as e:
-            logger.error(f"Error during model prediction: {e}")
+        prediction = predict_from_features(FEdata)
+        if prediction is None:
             return None
 
-        mean_prediction = np.mean(predictions)
-        logger.info(f"Mean prediction: {mean_prediction}")
-        prediction = math.ceil(mean_prediction)
-        logger.info(f"Final prediction (rounded): {prediction}")
-
         # Use the new step counting function
-        number_of_steps = count_steps_from_accelerometer(data)
+        number_of_steps = count_steps_from_accelerometer(data, raw=raw)
 
         return {"prediction": prediction, "steps": number_of_steps}
     except Exception as e:
         logger.error(f"Error in predict_lameness: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+def predict_lameness_window(window):
+    """Same as predict_lameness for a window emitted by an AccelerometerStream."""
+    logger.info("predict_lameness_window called")
+    try:
+        prediction = predict_from_features(window["lameness_features"])
+        if prediction is None:
+            return None
+        number_of_steps = count_steps_from_accelerometer(None, raw=window["acceleration"])
+        return {"prediction": prediction, "steps": number_of_steps}
+    except Exception as e:
+        logger.error(f"Error in predict_lameness_window: {e}")
+        return None
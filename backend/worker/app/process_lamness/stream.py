@@ -0,0 +1,162 @@
+import os
+import time
+import numpy as np
+from app.logging_service import MultiprocessLogger
+from app.model_registry import ModelRegistry
+from app.process_lamness.preprocess_lamness import FEATURES, FEATURE_COLUMNS, ROLLING_WINDOW
+
+logger = MultiprocessLogger.get_logger(__name__)
+
+# Feature rows in each emitted prediction window
+ACC_WINDOW_SIZE = int(os.getenv("ACC_WINDOW_SIZE", 100))
+# Running sums are recomputed from the ring buffer this often to stop float drift
+RESYNC_INTERVAL = 1024
+# Seconds between checks of the scaler file for a retrained version
+SCALER_CHECK_INTERVAL = float(os.getenv("SCALER_CHECK_INTERVAL", 10))
+# Streams of bovines silent this long are dropped (seconds)
+ACC_STREAM_IDLE_TIMEOUT = float(os.getenv("ACC_STREAM_IDLE_TIMEOUT", 600))
+
+
+class AccelerometerStream:
+    """
+    Lameness features for one bovine, updated one reading at a time.
+
+    Keeps the last ROLLING_WINDOW scaled readings in a ring buffer with their
+    running sum and sum of squares, plus the cumulative sum since the stream
+    started, so each reading adds one feature row in O(1) and no rows are lost
+    at batch edges. Every `hop` new rows it emits the last `window_size` rows
+    (a sliding window) for prediction.
+    """
+
+    def __init__(self, scaler, window_size=ACC_WINDOW_SIZE, hop=20):
+        self.scaler = scaler
+        self.window_size = window_size
+        self.hop = hop
+        n_features = len(FEATURES)
+
+        self.ring = np.zeros((ROLLING_WINDOW, n_features))
+        self.rolling_sum = np.zeros(n_features)
+        self.rolling_sumsq = np.zeros(n_features)
+        self.cumsum = np.zeros(n_features)
+        self.count = 0
+
+        # Ring of the latest feature rows and the raw acceleration behind each
+        self.features = np.empty((window_size, len(FEATURE_COLUMNS)), dtype=np.float32)
+        self.acceleration = np.empty((window_size, 3), dtype=np.float32)
+        self.filled = 0
+        self.next_row = 0
+        self.pending = 0
+
+    def _scale(self, reading):
+        if getattr(self.scaler, 'mean_', None) is not None and getattr(self.scaler, 'scale_', None) is not None:
+            return (reading - self.scaler.mean_) / self.scaler.scale_
+        return np.asarray(self.scaler.transform(reading[np.newaxis]), dtype=np.float64)[0]
+
+    def push(self, reading):
+        """
+        Adds one reading (a dict keyed by FEATURES).
+
+        Returns:
+            dict: A window {"lameness_features": (rows, 48), "acceleration": (rows, 3)}
+            when `hop` new rows have accumulated since the last one, else None.
+        """
+        raw = np.array([reading.get(feature) for feature in FEATURES], dtype=np.float64)
+        if np.isnan(raw).any():
+            return None
+        scaled = self._scale(raw)
+
+        slot = self.count % ROLLING_WINDOW
+        if self.count >= ROLLING_WINDOW:
+            evicted = self.ring[slot]
+            self.rolling_sum -= evicted
+            self.rolling_sumsq -= evicted * evicted
+        self.ring[slot] = scaled
+        self.rolling_sum += scaled
+        self.rolling_sumsq += scaled * scaled
+        self.cumsum += scaled
+        self.count += 1
+        if self.count % RESYNC_INTERVAL == 0:
+            self.rolling_sum = self.ring.sum(axis=0)
+            self.rolling_sumsq = (self.ring * self.ring).sum(axis=0)
+
+        if self.count < ROLLING_WINDOW:
+            return None
+
+        # Same row layout as lameness_features: readings, cumsum, (mean, std) pairs
+        n_features = len(FEATURES)
+        mean = self.rolling_sum / ROLLING_WINDOW
+        variance = (self.rolling_sumsq - self.rolling_sum * mean) / (ROLLING_WINDOW - 1)
+        row = self.features[self.next_row]
+        row[:n_features] = scaled
+        row[n_features:2 * n_features] = self.cumsum
+        row[2 * n_features::2] = mean
+        row[2 * n_features + 1::2] = np.sqrt(np.maximum(variance, 0.0))
+        self.acceleration[self.next_row] = raw[:3]
+
+        self.next_row = (self.next_row + 1) % self.window_size
+        self.filled = min(self.filled + 1, self.window_size)
+        self.pending += 1
+        if self.pending < self.hop:
+            return None
+        self.pending = 0
+        return self.window()
+
+    def window(self):
+        """The latest `filled` feature rows in arrival order."""
+        order = (np.arange(self.next_row - self.filled, self.next_row)) % self.window_size
+        return {
+            "lameness_features": self.features[order],
+            "acceleration": self.acceleration[order],
+        }
+
+
+class AccelerometerStreams:
+    """
+    Per-bovine AccelerometerStream instances.
+
+    Lives in the main process and is fed from the MQTT thread, so the stream
+    state survives across batches no matter which pool process predicts them.
+    The scaler is looked up through ModelRegistry every SCALER_CHECK_INTERVAL
+    seconds; when the file was retrained all streams restart with the new one,
+    since their buffered rows were scaled with the old one. Streams idle for
+    ACC_STREAM_IDLE_TIMEOUT are dropped.
+    """
+
+    def __init__(self, window_size=ACC_WINDOW_SIZE, hop=20, idle_timeout=ACC_STREAM_IDLE_TIMEOUT):
+        self.window_size = window_size
+        self.hop = hop
+        self.idle_timeout = idle_timeout
+        self.streams = {}    # {bovine_id: AccelerometerStream}
+        self.last_seen = {}  # {bovine_id: time.monotonic() of its last reading}
+        self.scaler = None
+        self.last_check = None
+
+    def _check(self, now):
+        """Reloads the scaler and evicts idle streams, at most every SCALER_CHECK_INTERVAL."""
+        if self.last_check is not None and now - self.last_check < SCALER_CHECK_INTERVAL:
+            return
+        scaler = ModelRegistry.get_artifact("LAMNESS_SCALAR_MODEL_PATH")
+        self.last_check = now
+        if scaler is not self.scaler:
+            if self.streams:
+                logger.info(f"Lameness scaler changed, restarting {len(self.streams)} accelerometer streams")
+            self.scaler = scaler
+            self.streams.clear()
+            self.last_seen.clear()
+        idle = [bovine_id for bovine_id, seen in self.last_seen.items() if now - seen > self.idle_timeout]
+        for bovine_id in idle:
+            del self.streams[bovine_id]
+            del self.last_seen[bovine_id]
+        if idle:
+            logger.info(f"Dropped {len(idle)} idle accelerometer streams")
+
+    def push(self, bovine_id, reading):
+        """Feeds one reading to the bovine's stream; returns a window when one is due."""
+        now = time.monotonic()
+        self._check(now)
+        self.last_seen[bovine_id] = now
+        stream = self.streams.get(bovine_id)
+        if stream is None:
+            stream = self.streams[bovine_id] = AccelerometerStream(self.scaler, self.window_size, self.hop)
+            logger.info(f"Started accelerometer stream for bovine {bovine_id}")
+        return stream.push(reading)
@@ -0,0 +1,105 @@
+import bisect
+import hashlib
+import os
+import time
+from threading import Lock
+
+# Points per worker on the ring; more points spread bovines more evenly
+RING_VNODES = int(os.getenv("RING_VNODES", 128))
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent-hash ring mapping bovine ids to worker ids.
+
+    Each worker owns RING_VNODES points; a bovine belongs to the first point
+    at or after its hash. Adding or removing a worker only moves the bovines
+    on that worker's arcs, so every other shard stays where it is.
+    """
+
+    def __init__(self, nodes=(), vnodes=RING_VNODES):
+        self.vnodes = vnodes
+        self.points = []  # sorted hashes
+        self.owners = {}  # {hash: worker_id}
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        for i in range(self.vnodes):
+            point = _hash(f"{node}#{i}")
+            if point not in self.owners:
+                bisect.insort(self.points, point)
+                self.owners[point] = node
+
+    def remove(self, node):
+        self.points = [point for point in self.points if self.owners[point] != node]
+        self.owners = {point: self.owners[point] for point in self.points}
+
+    def owner(self, key):
+        """The worker owning `key`, or None if the ring is empty."""
+        if not self.points:
+            return None
+        index = bisect.bisect(self.points, _hash(key)) % len(self.points)
+        return self.owners[self.points[index]]
+
+
+class ShardMembership:
+    """
+    The set of live workers, built from their heartbeats, and the ring over them.
+
+    A worker is dropped when it says goodbye (its MQTT last will) or when no
+    heartbeat has arrived for `timeout` seconds; the ring is rebuilt on every
+    change, so the shards rebalance without any per-job coordination.
+    """
+
+    def __init__(self, worker_id, timeout):
+        self.worker_id = worker_id
+        self.timeout = timeout
+        self.lock = Lock()
+        self.last_seen = {worker_id: time.monotonic()}
+        self.ring = HashRing([worker_id])
+
+    def _rebuild(self):
+        self.ring = HashRing(sorted(self.last_seen))
+
+    def heartbeat(self, worker_id):
+        """Records a heartbeat. Returns True if the worker just joined."""
+        with self.lock:
+            joined = worker_id not in self.last_seen
+            self.last_seen[worker_id] = time.monotonic()
+            if joined:
+                self._rebuild()
+            return joined
+
+    def leave(self, worker_id):
+        """Removes a worker that went offline. Returns True if it was a member."""
+        with self.lock:
+            if worker_id == self.worker_id or self.last_seen.pop(worker_id, None) is None:
+                return False
+            self._rebuild()
+            return True
+
+    def expire(self):
+        """Drops workers whose heartbeats stopped. Returns their ids."""
+        with self.lock:
+            now = time.monotonic()
+            self.last_seen[self.worker_id] = now
+            expired = [worker_id for worker_id, seen in self.last_seen.items() if now - seen > self.timeout]
+            for worker_id in expired:
+                del self.last_seen[worker_id]
+            if expired:
+                self._rebuild()
+            return expired
+
+    def members(self):
+        with self.lock:
+            return sorted(self.last_seen)
+
+    def owns(self, key):
+        """True if this worker owns `key`'s shard."""
+        with self.lock:
+            return self.ring.owner(key) == self.worker_id
@@ -1,6 +1,7 @@
 # main.py
 import time
 import json
+import struct
 import ubinascii
 import machine
 from machine import Pin, I2S
@@ -24,6 +25,17 @@ MOCK_MQTT = "broker.hivemq.com"
 TOTAL_BYTES = SAMPLE_RATE * (BITS_PER_SAMPLE // 8) * CHANNELS * DURATION_SEC
 NUM_CHUNKS = TOTAL_BYTES // CHUNK_SIZE + (1 if TOTAL_BYTES % CHUNK_SIZE else 0)
 
+# Binary framing (worker: app/process_audio/audio_frames.py) instead of base64 JSON.
+# Header: version, type, bovine_id (8 bytes), session, index, total; then the payload.
+USE_BINARY_FRAMES = True
+FRAME_HEADER = ">BB8sHHH"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER)
+FRAME_VERSION = 1
+FRAME_START = 0
+FRAME_DATA = 1
+FRAME_END = 2
+session_id = 0
+
 #print(f"Audio will be split into {NUM_CHUNKS} chunks")
 
 def mqtt_connect(client_id="esp3-client", server = MQTT_BROKER, port=1883, max_retries=5,use_mock=False):
@@ -56,49 +68,88 @@ def ist_time():
     return time.localtime(time.time() + 19800)  # UTC + 5h30m = 19800 sec
 
 
-def on_button_press():
-    try:
-        buf = bytearray(CHUNK_SIZE)
-        print("Recording 5s of audio and sending...",iso8601_now(ist_time()))
-        audio_data = []
+def send_binary_clip():
+    global session_id
+    session_id = (session_id + 1) & 0xFFFF
+    bovine = BOVINE_ID.encode()
+    if len(bovine) > 8:
+        # struct would silently cut it to the 8-byte header field
+        raise ValueError("BOVINE_ID does not fit the 8-byte frame field: " + BOVINE_ID)
 
-            # Send start chunk
-        start_msg = json.dumps({
-                "bovine_id": BOVINE_ID,
-                "type": "start",
-                "timestamp": iso8601_now(ist_time()),
-                "chunks": NUM_CHUNKS
-        })
-        client.publish(MQTT_TOPIC, start_msg)
-
-            # Read and send chunks
-        chunk_index = 0
-        bytes_left = TOTAL_BYTES
-
-        while bytes_left > 0:
-            read_len = min(CHUNK_SIZE, bytes_left)
-            buf = bytearray(read_len)
-            i2s.readinto(buf)
-            encoded = ubinascii.b2a_base64(buf).decode().strip()
-
-            data_msg = json.dumps({
-                    "bovine_id": BOVINE_ID,
-                    "type": "data",
-                    "index": chunk_index,
-                    "data": encoded
-            })
-            client.publish(MQTT_TOPIC, data_msg)
-
-            chunk_index += 1
-            bytes_left -= read_len
-
-            # Send end chunk
-        end_msg = json.dumps({
+    def control_frame(frame_type):
+        timestamp = iso8601_now(ist_time()).encode()
+        return struct.pack(FRAME_HEADER, FRAME_VERSION, frame_type, bovine, session_id, 0, NUM_CHUNKS) + timestamp
+
+    client.publish(MQTT_TOPIC, control_frame(FRAME_START))
+
+    # One buffer for every chunk: header packed in place, PCM read right after it
+    frame = bytearray(FRAME_HEADER_SIZE + CHUNK_SIZE)
+    frame_view = memoryview(frame)
+    chunk_index = 0
+    bytes_left = TOTAL_BYTES
+
+    while bytes_left > 0:
+        read_len = min(CHUNK_SIZE, bytes_left)
+        struct.pack_into(FRAME_HEADER, frame, 0, FRAME_VERSION, FRAME_DATA, bovine,
+                         session_id, chunk_index, NUM_CHUNKS)
+        i2s.readinto(frame_view[FRAME_HEADER_SIZE:FRAME_HEADER_SIZE + read_len])
+        client.publish(MQTT_TOPIC, frame_view[:FRAME_HEADER_SIZE + read_len])
+
+        chunk_index += 1
+        bytes_left -= read_len
+
+    client.publish(MQTT_TOPIC, control_frame(FRAME_END))
+
+
+def send_json_clip():
+    buf = bytearray(CHUNK_SIZE)
+
+        # Send start chunk
+    start_msg = json.dumps({
+            "bovine_id": BOVINE_ID,
+            "type": "start",
+            "timestamp": iso8601_now(ist_time()),
+            "chunks": NUM_CHUNKS
+    })
+    client.publish(MQTT_TOPIC, start_msg)
+
+        # Read and send chunks
+    chunk_index = 0
+    bytes_left = TOTAL_BYTES
+
+    while bytes_left > 0:
+        read_len = min(CHUNK_SIZE, bytes_left)
+        buf = bytearray(read_len)
+        i2s.readinto(buf)
+        encoded = ubinascii.b2a_base64(buf).decode().strip()
+
+        data_msg = json.dumps({
                 "bovine_id": BOVINE_ID,
-                "type": "end",
-                "timestamp": iso8601_now(ist_time())
+                "type": "data",
+                "index": chunk_index,
+                "data": encoded
         })
-        client.publish(MQTT_TOPIC, end_msg)
+        client.publish(MQTT_TOPIC, data_msg)
+
+        chunk_index += 1
+        bytes_left -= read_len
+
+        # Send end chunk
+    end_msg = json.dumps({
+            "bovine_id": BOVINE_ID,
+            "type": "end",
+            "timestamp": iso8601_now(ist_time())
+    })
+    client.publish(MQTT_TOPIC, end_msg)
+
+
+def on_button_press():
+    try:
+        print("Recording 5s of audio and sending...",iso8601_now(ist_time()))
+        if USE_BINARY_FRAMES:
+            send_binary_clip()
+        else:
+            send_json_clip()
         set_color(0, 100, 100)      # light blue
         print("Finished sending one 5s audio session....Sleeping for 5s")
         
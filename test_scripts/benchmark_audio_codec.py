@@ -0,0 +1,93 @@
+# Compares the base64 JSON microphone messages with the binary audio frames:
+# bytes on the wire per clip and the worker-side CPU to decode every message
+# of a clip back to PCM.
+#
+# Run from the repo root:  python test_scripts/benchmark_audio_codec.py
+
+import base64
+import json
+import os
+import sys
+import time
+import wave
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "backend", "worker"))
+
+from app.process_audio.audio_frames import (encode_audio_frame, is_audio_frame, parse_audio_frame,
+                                            FRAME_START, FRAME_DATA, FRAME_END)
+
+WAV_FILE_PATH = os.path.join(ROOT, "test_scripts", "recording_01_bite_0.wav")
+CHUNK_SIZE = 1024
+CLIP_BYTES = 22500 * 2 * 5
+BOVINE_ID = "2"
+TIMESTAMP = "2025-01-01T12:00:00"
+RUNS = 50
+
+
+def clip_chunks():
+    with wave.open(WAV_FILE_PATH, "rb") as wav:
+        pcm = wav.readframes(wav.getnframes())
+    pcm = (pcm * (CLIP_BYTES // len(pcm) + 1))[:CLIP_BYTES]
+    return [pcm[i:i + CHUNK_SIZE] for i in range(0, len(pcm), CHUNK_SIZE)]
+
+
+def json_messages(chunks):
+    messages = [json.dumps({"bovine_id": BOVINE_ID, "type": "start", "timestamp": TIMESTAMP, "chunks": len(chunks)})]
+    for index, chunk in enumerate(chunks):
+        messages.append(json.dumps({"bovine_id": BOVINE_ID, "type": "data", "index": index,
+                                    "data": base64.b64encode(chunk).decode()}))
+    messages.append(json.dumps({"bovine_id": BOVINE_ID, "type": "end", "timestamp": TIMESTAMP}))
+    return [message.encode() for message in messages]
+
+
+def binary_messages(chunks):
+    total = len(chunks)
+    messages = [encode_audio_frame(FRAME_START, BOVINE_ID, 1, 0, total, TIMESTAMP.encode())]
+    messages += [encode_audio_frame(FRAME_DATA, BOVINE_ID, 1, index, total, chunk) for index, chunk in enumerate(chunks)]
+    messages.append(encode_audio_frame(FRAME_END, BOVINE_ID, 1, 0, total, TIMESTAMP.encode()))
+    return messages
+
+
+def decode_json(payloads):
+    pcm = []
+    for payload in payloads:
+        message = json.loads(payload.decode())
+        if message["type"] == "data":
+            pcm.append(base64.b64decode(message["data"]))
+    return b"".join(pcm)
+
+
+def decode_binary(payloads):
+    pcm = []
+    for payload in payloads:
+        if not is_audio_frame(payload):
+            continue
+        message = parse_audio_frame(payload)
+        if message["type"] == "data":
+            pcm.append(message["pcm"])
+    return b"".join(pcm)
+
+
+def timed(fn, payloads):
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        result = fn(payloads)
+    return result, (time.perf_counter() - start) / RUNS
+
+
+if __name__ == "__main__":
+    chunks = clip_chunks()
+    json_payloads = json_messages(chunks)
+    binary_payloads = binary_messages(chunks)
+
+    json_pcm, json_time = timed(decode_json, json_payloads)
+    binary_pcm, binary_time = timed(decode_binary, binary_payloads)
+    assert json_pcm == binary_pcm == b"".join(chunks), "decoded PCM differs"
+
+    json_bytes = sum(len(p) for p in json_payloads)
+    binary_bytes = sum(len(p) for p in binary_payloads)
+    print(f"{len(chunks)} chunks of {CHUNK_SIZE} bytes, {len(b''.join(chunks))} PCM bytes per clip")
+    print(f"json/base64: {json_bytes:8d} bytes on the wire, {json_time * 1e3:7.3f} ms decode per clip")
+    print(f"binary:      {binary_bytes:8d} bytes on the wire, {binary_time * 1e3:7.3f} ms decode per clip")
+    print(f"wire size {binary_bytes / json_bytes:.2%} of json, decode {json_time / binary_time:.1f}x faster")
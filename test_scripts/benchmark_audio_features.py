@@ -0,0 +1,50 @@
+# Compares the shared audio feature stage against the per-model librosa calls
+# it replaced: checks the features match and times both paths.
+#
+# Run from the repo root:  python test_scripts/benchmark_audio_features.py
+
+import os
+import sys
+import time
+import numpy as np
+import librosa
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "backend", "worker"))
+
+from app.process_audio.preprocess_audio import extract_audio_features
+
+WAV_FILE_PATH = os.path.join(ROOT, "test_scripts", "recording_01_bite_0.wav")
+CLIP_SECONDS = 5
+RUNS = 20
+
+
+def reference_features(y, sr):
+    mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13, hop_length=256, n_fft=1024).astype(np.float32)
+    mel_spec = librosa.feature.melspectrogram(y=y, sr=sr, n_fft=2048, hop_length=512, n_mels=90)
+    return mfcc, librosa.power_to_db(mel_spec)
+
+
+def timeit(fn, *args):
+    fn(*args)  # warm up
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        fn(*args)
+    return (time.perf_counter() - start) / RUNS * 1000
+
+
+if __name__ == "__main__":
+    y, sr = librosa.load(WAV_FILE_PATH)
+    # Loop the sample up to the length of one collar clip
+    y = np.resize(y, sr * CLIP_SECONDS)
+
+    ref_mfcc, ref_log_mel = reference_features(y, sr)
+    features = extract_audio_features(y, sr)
+    print(f"MFCC    shape {features.mfcc.shape}  max abs diff {np.abs(ref_mfcc - features.mfcc).max():.3e}")
+    print(f"log-mel shape {features.log_mel.shape}  max abs diff {np.abs(ref_log_mel - features.log_mel).max():.3e}")
+    assert np.allclose(ref_mfcc, features.mfcc, atol=1e-3)
+    assert np.allclose(ref_log_mel, features.log_mel, atol=1e-3)
+
+    ref_ms = timeit(reference_features, y, sr)
+    new_ms = timeit(extract_audio_features, y, sr)
+    print(f"reference: {ref_ms:.2f} ms/clip  shared stage: {new_ms:.2f} ms/clip  ({ref_ms / new_ms:.2f}x)")
@@ -4,10 +4,13 @@
 import datetime
 import json
 import paho.mqtt.client as mqtt
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
 import time
 import random
 import wave
 import base64
+import struct
 import cv2
 
 def encode_image_to_base64(image_path):
@@ -52,6 +55,28 @@ def publish_message(broker, port, topic, message):
     # Disconnect after sending
     client.disconnect()
 
+def publish_frame(broker, port, topic, metadata, image_path, use_properties=False):
+    """Publishes the raw image bytes on the binary camera topic.
+
+    Frame layout: big-endian uint16 header length, JSON header, image bytes.
+    With use_properties the metadata goes in MQTT v5 user properties instead
+    and the payload is the bare image.
+    """
+    client = mqtt.Client(protocol=mqtt.MQTTv5)
+    client.connect(broker, port, 60)
+
+    with open(image_path, "rb") as image_file:
+        image_data = image_file.read()
+    if use_properties:
+        properties = Properties(PacketTypes.PUBLISH)
+        properties.UserProperty = [(key, str(value)) for key, value in metadata.items()]
+        client.publish(topic, image_data, properties=properties)
+    else:
+        header = json.dumps(metadata).encode()
+        client.publish(topic, struct.pack(">H", len(header)) + header + image_data)
+    print(f"Published {len(image_data)} image bytes to {topic}: {metadata}")
+
+    client.disconnect()
 
 
 if __name__ == "__main__":
@@ -73,7 +98,13 @@ if __name__ == "__main__":
         }
     else:
         print("Failed to encode image. Exiting.")   
+    # Set to True to send the frame on the binary topic instead of base64 JSON
+    use_binary = False
     for i in range(1):
         time.sleep(5)
-        publish_message(broker, port, random.choice(topics), message)
+        if use_binary:
+            publish_frame(broker, port, "inference/camera/raw",
+                          {"bovine_id": "3", "timestamp": datetime.datetime.now().isoformat()}, image_path)
+        else:
+            publish_message(broker, port, random.choice(topics), message)
         time.sleep(1)
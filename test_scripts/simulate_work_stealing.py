@@ -0,0 +1,119 @@
+# Runs two DistributedWorker nodes against an in-process loopback broker and
+# shows the busy one handing its queued jobs to the idle one, each job running
+# exactly once: first with every message delivered, then with the first
+# handoff lost, which the sender recovers through revoke/revoked.
+#
+# The pipeline is replaced by a short sleep, so only the handoff is exercised.
+#
+# Run from the repo root:  python test_scripts/simulate_work_stealing.py
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "backend", "worker"))
+
+os.environ.setdefault("ASSIGNMENT_MODE", "hash")
+os.environ.setdefault("DISTRIBUTED_POOL_SIZE", "1")
+os.environ.setdefault("STEAL_INTERVAL", "0.05")
+os.environ.setdefault("HANDOFF_ACK_TIMEOUT", "0.3")
+
+import app.distributed_worker as dw
+
+JOBS = 8
+JOB_SECONDS = 0.2
+
+runs = []
+runs_lock = threading.Lock()
+
+
+def fake_inference(worker_id, job):
+    time.sleep(JOB_SECONDS)
+    with runs_lock:
+        runs.append((worker_id, job[0]["job"]))
+    return None, JOB_SECONDS
+
+
+class Message:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload.encode() if isinstance(payload, str) else payload
+
+
+class LoopbackBroker:
+    """Delivers every publish to every node, in order, from one thread; `drop` loses matching messages."""
+
+    def __init__(self):
+        self.nodes = []
+        self.pending = []
+        self.lock = threading.Lock()
+        self.drop = None
+
+    def client(self, node):
+        broker = self
+
+        class Client:
+            def publish(self, topic, payload, qos=0):
+                if broker.drop is not None and broker.drop(topic, payload):
+                    print(f"  broker: lost {payload[:60]}...")
+                    broker.drop = None
+                    return
+                with broker.lock:
+                    broker.pending.append(Message(topic, payload))
+
+        self.nodes.append(node)
+        return Client()
+
+    def pump(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for message in pending:
+            for node in self.nodes:
+                node.on_message(None, None, message)
+
+
+def run(drop=None):
+    runs.clear()
+    broker = LoopbackBroker()
+    busy, idle = dw.DistributedWorker(), dw.DistributedWorker()
+    names = {busy.worker_id: "busy", idle.worker_id: "idle"}
+    with ThreadPoolExecutor(1) as busy_pool, ThreadPoolExecutor(1) as idle_pool:
+        for node, pool in ((busy, busy_pool), (idle, idle_pool)):
+            node.client = broker.client(node)
+            node.executor = pool
+            node.joined.set()  # skip the JOIN_DELAY wait for the heartbeats
+        broker.drop = drop
+        for i in range(JOBS):
+            busy.queue_job(f"job-{i}", [{"topic": "inference/accelerometer", "bovine_id": i, "job": i}])
+
+        deadline = time.monotonic() + 20
+        while len(runs) < JOBS and time.monotonic() < deadline:
+            for node in (busy, idle):
+                node.submit_jobs()
+                node.advertise_idle()
+                node.check_handoffs()
+            broker.pump()
+            time.sleep(0.01)
+        time.sleep(JOB_SECONDS * 2)
+        broker.pump()
+
+    per_node = Counter(names[worker_id] for worker_id, _ in runs)
+    per_job = Counter(job for _, job in runs)
+    print(f"  ran {len(runs)} of {JOBS} jobs: {dict(per_node)}")
+    assert sorted(per_job) == list(range(JOBS)), f"missing jobs: {set(range(JOBS)) - set(per_job)}"
+    assert all(count == 1 for count in per_job.values()), f"jobs run twice: {per_job}"
+    assert per_node["idle"] > 0, "the idle node never got a job"
+    assert not busy.handoffs, f"handoffs still tracked: {busy.handoffs}"
+
+
+if __name__ == "__main__":
+    dw.run_inference_and_publish = fake_inference
+    print("All messages delivered:")
+    run()
+    print("First handoff lost:")
+    run(drop=lambda topic, payload: topic == dw.MQTT_TOPIC_STEAL and '"handoff"' in payload)
+    print("OK: every job ran once and the idle node took its share")